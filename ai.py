@@ -0,0 +1,348 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+
+# ------------------- FAKE CLIENT -------------------
+class FakeClient:
+    """Offline stand-in for the OpenAI client with artificial latency.
+
+    Implements just chat.completions.create; used for local development and
+    benchmarks (set AI_FAKE_LATENCY) so no API calls are made.
+    """
+
+    class _Object:
+        def __init__(self, **attrs):
+            self.__dict__.update(attrs)
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = self._Object(completions=self._Object(create=self.create))
+
+    def create(self, model, messages, max_tokens=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        prompt = messages[-1]['content']
+        content = f"[{model}] reply to: {prompt[-80:]}"
+        usage = self._Object(prompt_tokens=len(prompt) // 4 + 1, completion_tokens=len(content) // 4 + 1)
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        return self._Object(
+            choices=[self._Object(message=self._Object(content=content))],
+            usage=usage
+        )
+
+
+# ------------------- OPENAI CLIENT -------------------
+class AIError(Exception):
+    """An OpenAI API call failed (or no API key is configured)."""
+
+
+class RateLimitError(AIError):
+    """The OpenAI API rate limit was hit; worth retrying later."""
+
+
+class LazyOpenAIClient:
+    """OpenAI client that is created on first use.
+
+    The openai package takes most of a second and tens of MB to import, so
+    it is only loaded by processes that actually call the API, and a
+    missing API key only fails AI calls instead of startup. OpenAI errors
+    are re-raised as AIError / RateLimitError.
+    """
+
+    def __init__(self, api_key=None, **options):
+        self.options = dict(options, api_key=api_key)
+        self._client = None
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def _get(self):
+        with self._lock:
+            if self._client is None:
+                if not self.options['api_key']:
+                    raise AIError("OPENAI_API_KEY not found. Check your .env file.")
+                from openai import OpenAI
+                self._client = OpenAI(**self.options)
+            return self._client
+
+    def create(self, **kwargs):
+        client = self._get()
+        import openai
+        try:
+            return client.chat.completions.create(**kwargs)
+        except openai.RateLimitError as e:
+            raise RateLimitError(str(e)) from e
+        except openai.OpenAIError as e:
+            raise AIError(str(e)) from e
+
+
+# ------------------- REPLY CACHE -------------------
+def normalize_message(text):
+    """Lowercase, drop punctuation and collapse whitespace: "Price?? " -> "price"."""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+def reply_cache_key(message, tone, model):
+    raw = '\x00'.join((model, tone, normalize_message(message)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ReplyCache:
+    """Two-tier cache for AI replies: an in-process LRU in front of SQLite.
+
+    Entries expire after `ttl` seconds in both tiers. The memory tier holds at
+    most `max_items` entries; the ai_reply_cache table is pruned to
+    `db_max_rows`. Concurrent misses for the same key share one in-flight
+    call to `create`.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_items=1000, ttl=86400, db_max_rows=100000):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.db_max_rows = db_max_rows
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # Memory tier
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            reply, created_at = entry
+            if now - created_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return reply
+
+    def _put_memory(self, key, reply, created_at):
+        with self._lock:
+            self._items[key] = (reply, created_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    # SQLite tier
+    def _get_db(self, conn, key, now):
+        row = conn.execute(
+            'SELECT reply, created_at FROM ai_reply_cache WHERE cache_key=? AND created_at >= ?',
+            (key, now - self.ttl)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _put_db(self, conn, key, reply, created_at):
+        conn.execute(
+            'INSERT OR REPLACE INTO ai_reply_cache (cache_key, reply, created_at) VALUES (?, ?, ?)',
+            (key, reply, created_at)
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune(conn, created_at)
+        conn.commit()
+
+    def prune(self, conn, now=None):
+        now = time.time() if now is None else now
+        conn.execute('DELETE FROM ai_reply_cache WHERE created_at < ?', (now - self.ttl,))
+        conn.execute('''
+            DELETE FROM ai_reply_cache WHERE cache_key IN (
+                SELECT cache_key FROM ai_reply_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.db_max_rows,))
+
+    def get(self, conn, key):
+        now = time.time()
+        reply = self._get_memory(key, now)
+        if reply is not None:
+            self._count('memory_hits')
+            return reply, 'memory'
+        found = self._get_db(conn, key, now)
+        if found is not None:
+            self._count('db_hits')
+            self._put_memory(key, *found)
+            return found[0], 'db'
+        return None, None
+
+    def get_or_create(self, conn, key, create):
+        """Return (reply, source) where source is memory, db, coalesced or api.
+
+        `create` is only called by the first caller for a key; concurrent
+        callers wait for its result (or its exception).
+        """
+        reply, source = self.get(conn, key)
+        if reply is not None:
+            return reply, source
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not owner:
+            return future.result(), 'coalesced'
+
+        try:
+            # The previous owner may have finished between our lookup and now
+            reply = self._get_memory(key, time.time())
+            if reply is not None:
+                self._count('memory_hits')
+                future.set_result(reply)
+                return reply, 'memory'
+            self._count('misses')
+            reply = create()
+            created_at = time.time()
+            self._put_memory(key, reply, created_at)
+            self._put_db(conn, key, reply, created_at)
+            future.set_result(reply)
+            return reply, 'api'
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, size=len(self._items), inflight=len(self._inflight))
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# ------------------- SUMMARIES -------------------
+# Prompts are kept under SUMMARY_CHUNK_TOKENS (estimated at ~4 characters per
+# token); longer histories are summarized chunk by chunk and the partial
+# summaries merged, map-reduce style.
+SUMMARY_CHUNK_TOKENS = 3000
+SUMMARY_MAX_TOKENS = 150
+SUMMARIZE_PROMPT = "Summarize these customer messages:\n"
+MERGE_PROMPT = "Merge these summaries of one customer's conversation into a single summary:\n"
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def chunk_texts(texts, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Group texts into newline-joined chunks of at most max_tokens each.
+
+    A single text longer than the budget is truncated to fit.
+    """
+    max_chars = max_tokens * 4
+    chunk, size = [], 0
+    for text in texts:
+        text = text[:max_chars]
+        cost = estimate_tokens(text)
+        if chunk and size + cost > max_tokens:
+            yield '\n'.join(chunk)
+            chunk, size = [], 0
+        chunk.append(text)
+        size += cost
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+def complete(client, model, prompt, max_tokens=SUMMARY_MAX_TOKENS):
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens
+    )
+    return response.choices[0].message.content
+
+
+def summarize(client, model, texts, previous=None, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Summarize `texts`, folding in an earlier summary if given.
+
+    Map: one call per token-bounded chunk. Reduce: merge partial summaries
+    (starting with `previous`) in token-bounded groups until one is left.
+    """
+    # The instruction is part of every prompt, so it comes out of the chunk budget
+    map_tokens = max_tokens - estimate_tokens(SUMMARIZE_PROMPT)
+    reduce_tokens = max_tokens - estimate_tokens(MERGE_PROMPT)
+    partials = [complete(client, model, SUMMARIZE_PROMPT + chunk) for chunk in chunk_texts(texts, map_tokens)]
+    if previous:
+        partials.insert(0, previous)
+    while len(partials) > 1:
+        groups = list(chunk_texts(partials, reduce_tokens))
+        if len(groups) == len(partials):
+            # Each summary fills a chunk on its own; merge pairwise instead
+            groups = ['\n'.join(partials[i:i + 2]) for i in range(0, len(partials), 2)]
+        partials = [complete(client, model, MERGE_PROMPT + group) for group in groups]
+    return partials[0] if partials else ''
+
+
+def latest_summary(conn, customer_id):
+    return conn.execute(
+        'SELECT summary_text, last_message_id FROM ai_summaries WHERE customer_id=? '
+        'ORDER BY timestamp DESC, id DESC LIMIT 1',
+        (customer_id,)
+    ).fetchone()
+
+
+def current_summary(conn, customer_id):
+    """The stored summary if it already covers every message, else None."""
+    latest = latest_summary(conn, customer_id)
+    last_id = latest['last_message_id'] if latest else 0
+    newer = conn.execute(
+        'SELECT 1 FROM messages WHERE customer_id=? AND id > ? LIMIT 1', (customer_id, last_id)
+    ).fetchone()
+    if newer:
+        return None
+    return latest['summary_text'] if latest else ''
+
+
+def update_summary(conn, client, model, customer_id):
+    """Return an up-to-date summary for a customer, summarizing only new messages.
+
+    Each stored summary records the last message id it covers; when newer
+    messages exist only those are summarized and merged into it. Returns
+    (summary_text, updated).
+    """
+    latest = latest_summary(conn, customer_id)
+    last_id = latest['last_message_id'] if latest else 0
+    # +id keeps SQLite on the per-customer index instead of walking every newer message by rowid
+    rows = conn.execute(
+        'SELECT id, direction, message_text FROM messages WHERE customer_id=? AND +id > ? ORDER BY timestamp, id',
+        (customer_id, last_id or 0)
+    ).fetchall()
+    if latest and not rows:
+        return latest['summary_text'], False
+    if not rows:
+        return '', False
+
+    texts = [f"{r['direction'] or 'message'}: {r['message_text'] or ''}" for r in rows]
+    summary_text = summarize(client, model, texts, previous=latest['summary_text'] if latest else None)
+    conn.execute(
+        'INSERT INTO ai_summaries (customer_id, summary_text, timestamp, last_message_id) VALUES (?, ?, ?, ?)',
+        (customer_id, summary_text, datetime.now().isoformat(), max(r['id'] for r in rows))
+    )
+    conn.commit()
+    return summary_text, True
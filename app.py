@@ -1,83 +1,454 @@
-from flask import Flask, render_template, request, redirect, Response, jsonify
+from flask import Flask, render_template, request, redirect, Response, jsonify, g
 from flask_cors import CORS
-import sqlite3
+import click
+import csv
+import functools
+import io
+import json
 import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError, OpenAIError
-from datetime import datetime
+from init_db import ARCHIVED_TABLES, CATEGORY_SQL, CUSTOMER_TABLES, MIGRATIONS, STATS_UPSERT_SQL, schema_version
+import ai
+import archive
+import db
+import group_commit
+import ingest
+import jobs
+import metrics
+import page_cache
+import scheduler
+import tagging
+import tenants
 
 # Load API Key
 load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("OPENAI_API_KEY not found. Check your .env file.")
+if os.getenv("AI_FAKE_LATENCY"):
+    # Offline stand-in for development and benchmarks
+    client = ai.FakeClient(latency=float(os.getenv("AI_FAKE_LATENCY")))
+else:
+    # openai is imported on the first AI call, not at startup
+    client = ai.LazyOpenAIClient(api_key=os.getenv("OPENAI_API_KEY"))
+AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 
-client = OpenAI(api_key=api_key)
+reply_cache = ai.ReplyCache(
+    max_items=int(os.getenv("AI_CACHE_SIZE", "1000")),
+    ttl=int(os.getenv("AI_CACHE_TTL", "86400")),
+    db_max_rows=int(os.getenv("AI_CACHE_DB_ROWS", "100000"))
+)
 
 # ---------- CONFIG ----------
 app = Flask(__name__)
 CORS(app)
-DB = 'crm.db'
+app.config['DATABASE'] = os.getenv('CRM_DB', db.DB)
+db.init_app(app)
+
+# Multi-tenant mode: with TENANTS_DIR set each business has its own database
+# file (see tenants.py), picked per request from the X-Tenant header or,
+# with TENANT_DOMAIN, the subdomain. Endpoints listed here serve all tenants.
+TENANT_EXEMPT = ('metrics_endpoint', 'admin_tenants', 'static')
+tenant_router = None
+if os.getenv("TENANTS_DIR"):
+    tenant_router = tenants.TenantRouter(os.getenv("TENANTS_DIR"), domain=os.getenv("TENANT_DOMAIN"))
+    tenants.init_app(app, tenant_router, exempt=TENANT_EXEMPT)
+
+# Old messages and activity moved out by archive.py live in an attached
+# archive database and are read through when older history is requested.
+# Each database has its own archive next to it unless ARCHIVE_DB names one.
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true") == "true"
+if ARCHIVE_ENABLED:
+    archive.enable(None if tenant_router else os.getenv("ARCHIVE_DB"))
+
+# Due reminders are fired by a background thread started with the first
+# request; set REMINDER_SCHEDULER=false when it runs as its own process
+# (python scheduler.py).
+REMINDER_SCHEDULER = os.getenv("REMINDER_SCHEDULER", "true") == "true"
+
+# Request, SQL and OpenAI metrics at /metrics; set METRICS_ENABLED=false to
+# skip all instrumentation.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true") == "true"
+if METRICS_ENABLED:
+    metrics.init_app(app, slow_query_ms=float(os.getenv("SLOW_QUERY_MS", "100")))
+    client = metrics.InstrumentedClient(client)
+
+# AI calls run on background workers (see AI JOBS below) so slow API round
+# trips never hold a request worker; all workers share one rate limit.
+ai_client = jobs.RateLimitedClient(client, jobs.RateLimiter(int(os.getenv("AI_RATE_LIMIT_PER_MINUTE", "60"))))
+
+# Rendered dashboard and profile pages, reused until their data changes
+rendered_pages = page_cache.PageCache(
+    max_items=int(os.getenv("PAGE_CACHE_SIZE", "500")),
+    max_bytes=int(os.getenv("PAGE_CACHE_MB", "32")) * 1024 * 1024
+)
+
+# Optional write-behind mode: message and order writes from concurrent
+# requests are committed together by a single writer thread.
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false") == "true"
+
+class Services:
+    """Background threads working on one database file.
+
+    The reminder scheduler, the AI job workers and (in write-behind mode) the
+    group-commit writer each belong to a database, so every tenant gets its
+    own; they start on first use. At most SERVICES_MAX databases have
+    services at a time; the least recently used are stopped beyond that.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reminder_scheduler = scheduler.ReminderScheduler(path)
+        self.job_queue = jobs.JobQueue(
+            path,
+            workers=int(os.getenv("AI_WORKERS", "4")),
+            retry_on=(ai.RateLimitError,)
+        )
+        self.job_queue.register('reply', run_reply_job)
+        self.job_queue.register('summary', run_summary_job)
+        self.group_writer = None
+        if WRITE_BEHIND:
+            self.group_writer = group_commit.GroupCommitWriter(
+                path,
+                max_batch=int(os.getenv("WRITE_BATCH_SIZE", "256")),
+                max_delay=float(os.getenv("WRITE_BATCH_MS", "2")) / 1000
+            )
+
+    def stop(self):
+        self.reminder_scheduler.stop()
+        self.job_queue.stop()
+        if self.group_writer is not None:
+            self.group_writer.stop()
+
+# With one database per tenant this bounds the background threads and their
+# connections; a stopped tenant's reminders and queued jobs resume with its
+# next request.
+SERVICES_MAX = int(os.getenv("TENANT_SERVICES", "16"))
+_services = OrderedDict()
+_services_lock = threading.Lock()
+
+def services(path=None):
+    """Services of `path`, by default the current request's database."""
+    path = path or db.current_path()
+    evicted = []
+    with _services_lock:
+        if path in _services:
+            _services.move_to_end(path)
+        else:
+            _services[path] = Services(path)
+            while len(_services) > max(SERVICES_MAX, 1):
+                evicted.append(_services.popitem(last=False)[1])
+        current = _services[path]
+    for s in evicted:
+        # Stopping waits for running jobs; keep that off the request
+        threading.Thread(target=s.stop, name='services-stop', daemon=True).start()
+    return current
+
+def stop_services():
+    with _services_lock:
+        running = list(_services.values())
+        _services.clear()
+    for s in running:
+        s.stop()
+
+@app.before_request
+def start_reminder_scheduler():
+    # Requests to tenant-exempt endpoints have no database of their own
+    if REMINDER_SCHEDULER and (tenant_router is None or 'tenant' in g):
+        services().reminder_scheduler.start()
 
 # ------------------- DB CONNECTION -------------------
-def get_db_connection():
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    return conn
+# One pooled connection per thread, bound to the request and cleaned up in
+# teardown (see db.py), so helpers called from a route share its connection.
+def get_db_connection(readonly=False):
+    return db.get_db(readonly)
 
-# ------------------- LEAD SCORING -------------------
-def calculate_lead_score(customer_id):
-    conn = get_db_connection()
-    orders_count = conn.execute(
-        'SELECT COUNT(*) FROM orders WHERE customer_id=?', (customer_id,)
-    ).fetchone()[0]
-    messages_count = conn.execute(
-        'SELECT COUNT(*) FROM messages WHERE customer_id=?', (customer_id,)
-    ).fetchone()[0]
-    conn.close()
-    score = orders_count*2 + messages_count
-    if score >= 10:
-        return 'VIP'
-    elif score >= 5:
-        return 'Active'
-    else:
-        return 'Lead'
+def commit_write(fn, *args):
+    """Run fn(conn, *args) in its own transaction and return its result.
 
-# ------------------- DASHBOARD -------------------
-@app.route('/')
-def index():
+    In write-behind mode the group-commit writer runs it alongside other
+    requests' writes; either way it has been committed when this returns.
+    """
+    group_writer = services().group_writer
+    if group_writer is not None:
+        return group_writer.write(fn, *args)
     conn = get_db_connection()
-    
-    total_customers = conn.execute('SELECT COUNT(*) FROM customers').fetchone()[0]
-    total_messages = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
-    total_orders = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
-    total_revenue = conn.execute('SELECT SUM(price) FROM orders').fetchone()[0] or 0
+    result = fn(conn, *args)
+    conn.commit()
+    return result
 
-    rows = conn.execute('SELECT * FROM customers').fetchall()
-    customers = []
+# ------------------- LEAD SCORING -------------------
+def update_customer_stats(conn, customer_id, orders=0, messages=0, revenue=0, last_activity=None):
+    """Apply a delta to customer_stats as part of the caller's transaction.
+
+    last_activity defaults to now; it never moves an existing value backwards.
+    """
+    conn.execute(STATS_UPSERT_SQL, (customer_id, orders, messages, revenue, last_activity))
+    conn.execute(f'UPDATE customer_stats SET category = {CATEGORY_SQL} WHERE customer_id=?', (customer_id,))
+
+def get_customer_stats(conn, customer_id):
+    row = conn.execute('SELECT * FROM customer_stats WHERE customer_id=?', (customer_id,)).fetchone()
+    if row:
+        return dict(row)
+    return {'customer_id': customer_id, 'orders_count': 0, 'messages_count': 0,
+            'total_revenue': 0, 'last_activity': None, 'category': 'Lead'}
 
+# ------------------- DASHBOARD DATA -------------------
+# Per-customer aggregates come from the customer_stats table, joined onto
+# customers in a single query, so the number of queries does not depend on
+# how many customers there are.
+DASHBOARD_CUSTOMERS_SQL = '''
+SELECT c.*,
+       COALESCE(s.orders_count, 0) AS orders_count,
+       COALESCE(s.total_revenue, 0) AS revenue,
+       COALESCE(s.messages_count, 0) AS messages_count,
+       COALESCE(s.category, 'Lead') AS lead_category
+FROM customers c
+LEFT JOIN customer_stats s ON s.customer_id = c.id
+'''
+
+def dashboard_customers(conn, where='', params=(), limit=None):
+    """Return (customers, customer_orders) for the dashboard table and chart.
+
+    `where` is an optional SQL filter on the `c` (customers) alias.
+    """
+    sql = DASHBOARD_CUSTOMERS_SQL + where + ' ORDER BY c.id'
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    rows = conn.execute(sql, params).fetchall()
+    customers = []
+    customer_orders = {}
     for r in rows:
         customer = dict(r)
-        customer['category'] = calculate_lead_score(customer['id'])
+        customer['category'] = customer.pop('lead_category')
         customers.append(customer)
+        customer_orders[customer['id']] = customer['orders_count']
+    return customers, customer_orders
 
-    customer_orders = {}
-    for c in customers:
-        count = conn.execute('SELECT COUNT(*) FROM orders WHERE customer_id=?', (c['id'],)).fetchone()[0]
-        customer_orders[c['id']] = count
+def dashboard_page(conn, after=0):
+    """One page of the dashboard table after customer id `after`.
+
+    Returns (customers, customer_orders, next_after); next_after is None on
+    the last page.
+    """
+    customers, customer_orders = dashboard_customers(conn, 'WHERE c.id > ?', (after,), limit=PAGE_SIZE + 1)
+    next_after = None
+    if len(customers) > PAGE_SIZE:
+        customers = customers[:PAGE_SIZE]
+        next_after = customers[-1]['id']
+        customer_orders = {c['id']: customer_orders[c['id']] for c in customers}
+    return customers, customer_orders, next_after
+
+def dashboard_totals(conn):
+    # Read from the trigger-maintained rollups (see init_db.py), so the cost
+    # depends on the number of months of history, not on the number of rows.
+    row = conn.execute('''
+        SELECT (SELECT COALESCE(SUM(value), 0) FROM rollup_totals WHERE metric='customers') AS total_customers,
+               (SELECT COALESCE(SUM(value), 0) FROM monthly_rollups WHERE metric='messages') AS total_messages,
+               (SELECT COALESCE(SUM(value), 0) FROM monthly_rollups WHERE metric='orders') AS total_orders,
+               (SELECT COALESCE(SUM(value), 0) FROM monthly_rollups WHERE metric='revenue') AS total_revenue
+    ''').fetchone()
+    return dict(row)
+
+# ------------------- PAGINATION -------------------
+# List views are paged with keyset cursors instead of OFFSET, so the cost of
+# a page depends on the page size, not on how much history precedes it.
+PAGE_SIZE = 50
+
+# Per-customer timelines that can be paged, by name used in URLs
+TIMELINES = {
+    'messages': 'messages',
+    'orders': 'orders',
+    'activities': 'activity_timeline',
+}
+
+def encode_cursor(row):
+    return f"{row['timestamp']}|{row['id']}"
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    timestamp, _, row_id = cursor.rpartition('|')
+    try:
+        return timestamp, int(row_id)
+    except ValueError:
+        return None
+
+def timeline_page(conn, table, customer_id, before=None, limit=PAGE_SIZE):
+    """Newest-first rows of a customer's timeline older than the `before` cursor.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page. The
+    (timestamp, id) keyset is served by the (customer_id, timestamp) index.
+    Reads through to the archive only when the page reaches back past its
+    newest row.
+    """
+    sql = f'SELECT * FROM {table} WHERE customer_id=?'
+    params = [customer_id]
+    position = decode_cursor(before)
+    if position:
+        sql += ' AND (timestamp, id) < (?, ?)'
+        params += list(position)
+    sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+    if ARCHIVE_ENABLED and table in ARCHIVED_TABLES:
+        newest_archived = archive.horizon(conn, table)
+        if newest_archived is not None and (len(rows) <= limit or (rows[-1]['timestamp'] or '') <= newest_archived):
+            rows = archive.timeline(conn, table, customer_id, position, limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@app.route('/history/<string:kind>/<int:customer_id>')
+def history(kind, customer_id):
+    """JSON chunk of older timeline rows for lazy loading, newest first."""
+    if kind not in TIMELINES:
+        return jsonify({"error": f"Unknown history: {kind}"}), 404
+    conn = get_db_connection(readonly=True)
+    rows, next_cursor = timeline_page(conn, TIMELINES[kind], customer_id, request.args.get('before'))
+    return jsonify({"items": [dict(r) for r in rows], "next": next_cursor})
+
+# ------------------- PAGE CACHE -------------------
+def cached_page(customer_arg=None):
+    """Serve an HTML view through the page cache, with ETag and Last-Modified.
+
+    Pages are versioned per customer (named by the view argument
+    `customer_arg`) or as the dashboard. Browsers revalidate on every load
+    and get 304 Not Modified while the version is unchanged; otherwise the
+    page comes from rendered_pages if it was rendered for this version.
+    Tenants share the cache, with their own keys and ETags.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            customer_id = kwargs[customer_arg] if customer_arg else page_cache.DASHBOARD
+            version, modified = page_cache.page_version(get_db_connection(readonly=True), customer_id)
+            etag = f'{customer_id}-{version}'
+            response = Response(mimetype='text/html')
+            if tenant_router is not None:
+                etag = f'{g.tenant}-{etag}'
+                response.vary.add(tenant_router.header)
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.no_cache = True
+            if response.make_conditional(request).status_code == 304:
+                rendered_pages.count('not_modified')
+                return response
+            key = (db.current_path(), request.full_path)
+            body = rendered_pages.get(key, etag)
+            if body is None:
+                body = view(**kwargs)
+                rendered_pages.put(key, etag, body)
+            response.set_data(body)
+            return response
+        return wrapper
+    return decorator
+
+@app.route('/page_cache/stats')
+def page_cache_stats():
+    return jsonify(rendered_pages.stats())
 
-    conn.close()
+# ------------------- DASHBOARD -------------------
+@app.route('/')
+@cached_page()
+def index():
+    conn = get_db_connection(readonly=True)
+    totals = dashboard_totals(conn)
+    customers, customer_orders, next_after = dashboard_page(conn, request.args.get('after', 0, type=int))
     return render_template(
         'index.html',
-        total_customers=total_customers,
-        total_messages=total_messages,
-        total_orders=total_orders,
-        total_revenue=total_revenue,
         customers=customers,
         customer_orders=customer_orders,
-        ai_enabled=os.getenv("AI_ENABLED", "true") == "true"
+        next_after=next_after,
+        ai_enabled=os.getenv("AI_ENABLED", "true") == "true",
+        **totals
     )
 
+# ------------------- ANALYTICS -------------------
+# JSON for the dashboard charts, served from the rollup tables.
+ANALYTICS_METRICS = ('orders', 'revenue', 'messages', 'new_customers')
+ANALYTICS_BUCKETS = {
+    # bucket: (table, bucket expression, default range in days)
+    'day': ('daily_rollups', 'day', 30),
+    'week': ('daily_rollups', "date(day, '-6 days', 'weekday 1')", 7 * 12),
+    'month': ('monthly_rollups', 'month', 365),
+}
+
+def analytics_labels(bucket, start, until):
+    """Every bucket label from start to until, so charts get empty buckets as zeros."""
+    if bucket == 'month':
+        months = range(start.year * 12 + start.month - 1, until.year * 12 + until.month)
+        return [f'{m // 12:04d}-{m % 12 + 1:02d}' for m in months]
+    step = 7 if bucket == 'week' else 1
+    return [(start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(0, (until - start).days + 1, step)]
+
+@app.route('/analytics/summary')
+def analytics_summary():
+    """Dashboard totals plus customers per stage and orders/revenue per status."""
+    conn = get_db_connection(readonly=True)
+    by_status = {}
+    for r in conn.execute(
+        "SELECT metric, dimension, SUM(value) AS value FROM monthly_rollups "
+        "WHERE metric IN ('orders', 'revenue') GROUP BY metric, dimension"
+    ):
+        by_status.setdefault(r['dimension'], {})[r['metric']] = r['value']
+    return jsonify({
+        **dashboard_totals(conn),
+        "stages": {r['dimension']: r['value'] for r in conn.execute(
+            "SELECT dimension, value FROM rollup_totals WHERE metric='customers' AND value != 0 ORDER BY value DESC"
+        )},
+        "order_status": by_status,
+    })
+
+@app.route('/analytics/<string:metric>')
+def analytics_series(metric):
+    """Time series of one metric: ?bucket=day|week|month, ?from and ?until
+    (YYYY-MM-DD), and ?split=1 for one series per status or direction.
+    """
+    if metric not in ANALYTICS_METRICS:
+        return jsonify({"error": f"Unknown metric. Choose from: {', '.join(ANALYTICS_METRICS)}."}), 400
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ANALYTICS_BUCKETS:
+        return jsonify({"error": "bucket must be day, week or month."}), 400
+    table, label, default_days = ANALYTICS_BUCKETS[bucket]
+    try:
+        until = datetime.fromisoformat(request.args.get('until') or datetime.now().strftime('%Y-%m-%d'))
+        start = request.args.get('from')
+        start = datetime.fromisoformat(start) if start else until - timedelta(days=default_days - 1)
+    except ValueError:
+        return jsonify({"error": "from and until must be dates (YYYY-MM-DD)."}), 400
+
+    if bucket == 'month':
+        bounds = (start.strftime('%Y-%m'), until.strftime('%Y-%m'))
+        column = 'month'
+    else:
+        # Weeks are labelled by their Monday, so start from the Monday of ?from
+        if bucket == 'week':
+            start -= timedelta(days=start.weekday())
+        bounds = (start.strftime('%Y-%m-%d'), until.strftime('%Y-%m-%d'))
+        column = 'day'
+    labels = analytics_labels(bucket, start, until)
+    if len(labels) > 1000:
+        return jsonify({"error": "Range too long; use a larger bucket."}), 400
+    split = request.args.get('split') in ('1', 'true')
+    rows = get_db_connection(readonly=True).execute(f'''
+        SELECT {label} AS bucket, {'dimension' if split else "''"} AS dimension, SUM(value) AS value
+        FROM {table}
+        WHERE metric=? AND {column} BETWEEN ? AND ?
+        GROUP BY 1, 2 ORDER BY 1, 2
+    ''', (metric, *bounds)).fetchall()
+
+    series = {'': dict.fromkeys(labels, 0)} if not split else {}
+    for r in rows:
+        series.setdefault(r['dimension'], dict.fromkeys(labels, 0))[r['bucket']] = r['value']
+    return jsonify({
+        "metric": metric,
+        "bucket": bucket,
+        "labels": labels,
+        "series": {dimension or metric: list(values.values()) for dimension, values in series.items()},
+    })
+
 # ------------------- ADD CUSTOMER -------------------
 @app.route('/add', methods=['GET', 'POST'])
 def add_customer():
@@ -104,9 +475,7 @@ def add_customer():
                 (name, instagram_handle, email, phone, category, stage)
             )
             conn.commit()
-            conn.close()
             return redirect('/')
-        conn.close()
     return render_template('add_customer.html', message=message)
 # ------------------- EDIT CUSTOMER -------------------
 @app.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -134,42 +503,127 @@ def edit_customer(id):
                 (name, instagram_handle, email, phone, category, stage, id)
             )
             conn.commit()
-            conn.close()
             return redirect('/')
-    conn.close()
     return render_template('edit_customer.html', customer=customer, message=message)
 
 # ------------------- DELETE CUSTOMER -------------------
-@app.route('/delete/<int:id>')
+# Messages, orders, tags, reminders, activity, AI rows and stats are removed
+# by ON DELETE CASCADE foreign keys in the same transaction as the customer;
+# archived history is deleted explicitly.
+def request_ids(name='ids'):
+    data = request.get_json(silent=True) or {}
+    values = data.get(name) if data else request.form.getlist(name)
+    try:
+        return sorted({int(v) for v in values or []})
+    except (TypeError, ValueError):
+        return None
+
+def delete_customers(conn, ids):
+    archive.forget_customers(conn, ids)
+    deleted = conn.executemany('DELETE FROM customers WHERE id=?', [(i,) for i in ids]).rowcount
+    conn.commit()
+    return deleted
+
+@app.route('/delete/<int:id>', methods=['GET', 'POST'])
 def delete_customer(id):
+    delete_customers(get_db_connection(), [id])
+    return redirect('/')
+
+@app.route('/customers/delete', methods=['POST'])
+def delete_customers_batch():
+    ids = request_ids()
+    if not ids:
+        return jsonify({"error": "A list of customer ids is required."}), 400
+    return jsonify({"deleted": delete_customers(get_db_connection(), ids)})
+
+def merge_customers(conn, target_id, source_ids):
+    """Move everything owned by source_ids onto target_id, then delete the sources."""
+    placeholders = ','.join('?' * len(source_ids))
+    # The target is in the MAX so a merge of dormant customers keeps them dormant
+    stats = conn.execute(
+        f'SELECT COALESCE(SUM(orders_count) FILTER (WHERE customer_id != ?), 0), '
+        f'COALESCE(SUM(messages_count) FILTER (WHERE customer_id != ?), 0), '
+        f'COALESCE(SUM(total_revenue) FILTER (WHERE customer_id != ?), 0), MAX(last_activity) '
+        f'FROM customer_stats WHERE customer_id IN (?, {placeholders})',
+        [target_id] * 4 + list(source_ids)
+    ).fetchone()
+    for table in CUSTOMER_TABLES:
+        if table in ('customer_stats', 'ai_summaries'):
+            continue
+        # OR IGNORE: a tag the target already has stays on the source and cascades away
+        conn.execute(f'UPDATE OR IGNORE {table} SET customer_id=? WHERE customer_id IN ({placeholders})',
+                     [target_id, *source_ids])
+    for field in ('email', 'phone'):
+        conn.execute(
+            f'UPDATE customers SET {field} = (SELECT {field} FROM customers WHERE id IN ({placeholders}) '
+            f'AND {field} IS NOT NULL ORDER BY id LIMIT 1) WHERE id=? AND {field} IS NULL',
+            [*source_ids, target_id]
+        )
+    # Stored summaries no longer cover the merged history; the next view regenerates one
+    conn.execute('DELETE FROM ai_summaries WHERE customer_id=?', (target_id,))
+    archive.move_customers(conn, target_id, source_ids)
+    conn.executemany('DELETE FROM customers WHERE id=?', [(i,) for i in source_ids])
+    update_customer_stats(conn, target_id, orders=stats[0], messages=stats[1], revenue=stats[2],
+                          last_activity=stats[3])
+    conn.execute('INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
+                 (target_id, 'Merged customers: ' + ', '.join(map(str, source_ids))))
+
+@app.route('/customers/merge', methods=['POST'])
+def merge_customers_route():
     conn = get_db_connection()
-    conn.execute('DELETE FROM customers WHERE id=?', (id,))
-    conn.execute('DELETE FROM messages WHERE customer_id=?', (id,))
-    conn.execute('DELETE FROM orders WHERE customer_id=?', (id,))
+    data = request.get_json(silent=True) or request.form
+    try:
+        target_id = int(data.get('into'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'into' must be a customer id."}), 400
+    source_ids = [i for i in request_ids() or [] if i != target_id]
+    if not source_ids:
+        return jsonify({"error": "A list of duplicate customer ids is required."}), 400
+    found = conn.execute(
+        f'SELECT COUNT(*) FROM customers WHERE id IN ({",".join("?" * (len(source_ids) + 1))})',
+        [target_id, *source_ids]
+    ).fetchone()[0]
+    if found != len(source_ids) + 1:
+        return jsonify({"error": "Unknown customer id."}), 404
+    merge_customers(conn, target_id, source_ids)
     conn.commit()
-    conn.close()
-    return redirect('/')
+    return jsonify({"into": target_id, "merged": source_ids})
 
 # ------------------- AUTO-TAGGING -------------------
-def auto_tag_customer(customer_id, message_text):
-    tags = []
-    lower_msg = message_text.lower()
-    if any(word in lower_msg for word in ['price', 'cost', 'how much']):
-        tags.append('Interested')
-    if any(word in lower_msg for word in ['available', 'stock', 'in stock']):
-        tags.append('Hot Lead')
-    if any(word in lower_msg for word in ['order', 'buy', 'purchase']):
-        tags.append('Ready to Order')
+# Keyword rules live in the tag_rules table and are compiled into a single
+# matcher (see tagging.py); re-tag history with `python tagging.py retag`.
+def auto_tag_customer(conn, customer_id, message_text):
+    return tagging.apply_tags(conn, customer_id, message_text)
+
+@app.route('/tag_rules', methods=['GET', 'POST'])
+def tag_rules():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        tag = request.form['tag'].strip()
+        keyword = tagging.normalize_keyword(request.form['keyword'])
+        if not tag or not keyword:
+            return jsonify({"error": "Tag and keyword are required."}), 400
+        conn.execute('INSERT OR IGNORE INTO tag_rules (tag, keyword) VALUES (?, ?)', (tag, keyword))
+        conn.commit()
+    rules = conn.execute('SELECT * FROM tag_rules ORDER BY tag, keyword').fetchall()
+    return jsonify({"rules": [dict(r) for r in rules]})
 
+@app.route('/tag_rules/delete/<int:id>', methods=['POST'])
+def delete_tag_rule(id):
     conn = get_db_connection()
-    for tag in tags:
-        conn.execute('INSERT INTO customer_tags (customer_id, tag) VALUES (?, ?)', (customer_id, tag))
-        conn.execute('INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)', 
-                     (customer_id, f'Auto-tagged: {tag}'))
+    conn.execute('DELETE FROM tag_rules WHERE id=?', (id,))
     conn.commit()
-    conn.close()
+    return jsonify({"deleted": id})
 
 # ------------------- VIEW MESSAGES -------------------
+def record_message(conn, customer_id, message_text, direction):
+    conn.execute(
+        'INSERT INTO messages (customer_id, message_text, direction) VALUES (?, ?, ?)',
+        (customer_id, message_text, direction)
+    )
+    update_customer_stats(conn, customer_id, messages=1)
+    auto_tag_customer(conn, customer_id, message_text)
+
 @app.route('/messages/<int:customer_id>', methods=['GET', 'POST'])
 def messages(customer_id):
     conn = get_db_connection()
@@ -178,17 +632,11 @@ def messages(customer_id):
     if request.method == 'POST':
         message_text = request.form['message']
         direction = request.form['direction']
-        conn.execute(
-            'INSERT INTO messages (customer_id, message_text, direction) VALUES (?, ?, ?)',
-            (customer_id, message_text, direction)
-        )
-        conn.commit()
-        auto_tag_customer(customer_id, message_text)
+        commit_write(record_message, customer_id, message_text, direction)
 
-    messages = conn.execute(
-        'SELECT * FROM messages WHERE customer_id=? ORDER BY timestamp ASC',
-        (customer_id,)
-    ).fetchall()
+    # Latest page, shown oldest-first like a chat; older_cursor loads the previous page
+    page, older_cursor = timeline_page(conn, 'messages', customer_id, request.args.get('before'))
+    messages = page[::-1]
 
     ai_summary = conn.execute(
         'SELECT summary_text FROM ai_summaries WHERE customer_id=? ORDER BY timestamp DESC LIMIT 1',
@@ -196,10 +644,18 @@ def messages(customer_id):
     ).fetchone()
     ai_summary_text = ai_summary['summary_text'] if ai_summary else "No summary yet."
 
-    conn.close()
-    return render_template('messages.html', customer=customer, messages=messages, ai_summary=ai_summary_text)
+    return render_template('messages.html', customer=customer, messages=messages, ai_summary=ai_summary_text,
+                           older_cursor=older_cursor)
 
 # ------------------- VIEW ORDERS -------------------
+def record_order(conn, customer_id, product_name, quantity, price, status):
+    conn.execute(
+        'INSERT INTO orders (customer_id, product_name, quantity, price, status) VALUES (?, ?, ?, ?, ?)',
+        (customer_id, product_name, quantity, price, status)
+    )
+    conn.execute("UPDATE customers SET stage='Ordered' WHERE id=?", (customer_id,))
+    update_customer_stats(conn, customer_id, orders=1, revenue=price)
+
 @app.route('/orders/<int:customer_id>', methods=['GET', 'POST'])
 def orders(customer_id):
     conn = get_db_connection()
@@ -210,25 +666,13 @@ def orders(customer_id):
         quantity = int(request.form['quantity'])
         price = float(request.form['price'])
         status = request.form.get('status', 'Pending')
-        conn.execute(
-            'INSERT INTO orders (customer_id, product_name, quantity, price, status) VALUES (?, ?, ?, ?, ?)',
-            (customer_id, product_name, quantity, price, status)
-        )
-        conn.execute("UPDATE customers SET stage='Ordered' WHERE id=?", (customer_id,))
-        conn.commit()
+        commit_write(record_order, customer_id, product_name, quantity, price, status)
 
-    orders = conn.execute(
-        'SELECT * FROM orders WHERE customer_id=? ORDER BY timestamp DESC',
-        (customer_id,)
-    ).fetchall()
+    orders, older_cursor = timeline_page(conn, 'orders', customer_id, request.args.get('before'))
 
-    clv = conn.execute(
-        'SELECT SUM(price) FROM orders WHERE customer_id=?',
-        (customer_id,)
-    ).fetchone()[0] or 0
+    clv = get_customer_stats(conn, customer_id)['total_revenue']
 
-    conn.close()
-    return render_template('orders.html', customer=customer, orders=orders, clv=clv)
+    return render_template('orders.html', customer=customer, orders=orders, clv=clv, older_cursor=older_cursor)
 
 # ------------------- REMINDERS -------------------
 @app.route('/reminders/<int:customer_id>', methods=['GET', 'POST'])
@@ -236,38 +680,88 @@ def reminders(customer_id):
     conn = get_db_connection()
     if request.method == 'POST':
         reminder_text = request.form['reminder_text']
-        reminder_date = request.form['reminder_date']
-        conn.execute('INSERT INTO reminders (customer_id, reminder_text, reminder_date) VALUES (?, ?, ?)',
-                     (customer_id, reminder_text, reminder_date))
+        try:
+            reminder_date = scheduler.normalize_due(request.form['reminder_date'])
+        except ValueError:
+            return jsonify({"error": "reminder_date must be a date or date and time."}), 400
+        reminder_id = conn.execute(
+            'INSERT INTO reminders (customer_id, reminder_text, reminder_date) VALUES (?, ?, ?)',
+            (customer_id, reminder_text, reminder_date)
+        ).lastrowid
         conn.execute('INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
                      (customer_id, f'Reminder added: {reminder_text}'))
         conn.commit()
-    reminders = conn.execute('SELECT * FROM reminders WHERE customer_id=?', (customer_id,)).fetchall()
-    conn.close()
+        if REMINDER_SCHEDULER:
+            # Otherwise a separate scheduler process picks it up
+            services().reminder_scheduler.schedule(reminder_id, reminder_date)
+    reminders = conn.execute(
+        'SELECT * FROM reminders WHERE customer_id=? ORDER BY reminder_date', (customer_id,)
+    ).fetchall()
     return render_template('reminders.html', customer_id=customer_id, reminders=reminders)
 
+DUE_REMINDERS_SQL = '''
+SELECT r.id, r.customer_id, c.name, c.instagram_handle, r.reminder_text, r.reminder_date, r.status
+FROM reminders r JOIN customers c ON c.id = r.customer_id
+WHERE r.reminder_date BETWEEN ? AND ?
+'''
+
+@app.route('/reminders/due')
+def due_reminders():
+    """Reminders across all customers due between ?from and ?until, oldest first.
+
+    Defaults to today. ?status=Pending or Done filters; ?after=<cursor>
+    fetches the next page. Served by the (status, reminder_date) or
+    (reminder_date) index, so a page never scans the whole table.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    try:
+        start = scheduler.normalize_due(request.args.get('from') or today)
+        end = request.args.get('until')
+        end = scheduler.normalize_due(end) if end else f'{today} 23:59:59'
+    except ValueError:
+        return jsonify({"error": "from and until must be dates or dates and times."}), 400
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), 500))
+
+    sql = DUE_REMINDERS_SQL
+    params = [start, end]
+    status = request.args.get('status')
+    if status:
+        sql += ' AND r.status=?'
+        params.append(status)
+    position = decode_cursor(request.args.get('after'))
+    if position:
+        sql += ' AND (r.reminder_date, r.id) > (?, ?)'
+        params += list(position)
+    sql += ' ORDER BY r.reminder_date, r.id LIMIT ?'
+    params.append(limit + 1)
+
+    rows = get_db_connection(readonly=True).execute(sql, params).fetchall()
+    next_cursor = f"{rows[limit - 1]['reminder_date']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return jsonify({"items": [dict(r) for r in rows[:limit]], "next": next_cursor})
+
 # ------------------- CUSTOMER PROFILE -------------------
 @app.route('/customer/<int:customer_id>')
+@cached_page('customer_id')
 def customer_profile(customer_id):
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     customer = conn.execute('SELECT * FROM customers WHERE id=?', (customer_id,)).fetchone()
-    messages = conn.execute('SELECT * FROM messages WHERE customer_id=? ORDER BY timestamp ASC', (customer_id,)).fetchall()
-    orders = conn.execute('SELECT * FROM orders WHERE customer_id=? ORDER BY timestamp DESC', (customer_id,)).fetchall()
+    messages, older_messages = timeline_page(conn, 'messages', customer_id)
+    orders, older_orders = timeline_page(conn, 'orders', customer_id)
     tags = conn.execute('SELECT tag FROM customer_tags WHERE customer_id=?', (customer_id,)).fetchall()
     reminders_list = conn.execute('SELECT * FROM reminders WHERE customer_id=?', (customer_id,)).fetchall()
-    activities = conn.execute('SELECT * FROM activity_timeline WHERE customer_id=? ORDER BY timestamp DESC', (customer_id,)).fetchall()
-    clv = conn.execute('SELECT SUM(price) FROM orders WHERE customer_id=?', (customer_id,)).fetchone()[0] or 0
+    activities, older_activities = timeline_page(conn, 'activity_timeline', customer_id)
+    clv = get_customer_stats(conn, customer_id)['total_revenue']
 
     summary_row = conn.execute('SELECT summary_text FROM ai_summaries WHERE customer_id=? ORDER BY timestamp DESC LIMIT 1', 
                                (customer_id,)).fetchone()
     ai_summary = summary_row['summary_text'] if summary_row else ''
 
-    conn.close()
     return render_template(
         'customer_profile.html',
         customer=customer,
-        messages=messages,
+        messages=messages[::-1],
         orders=orders,
+        older_cursors={'messages': older_messages, 'orders': older_orders, 'activities': older_activities},
         clv=clv,
         tags=[t['tag'] for t in tags],
         reminders=reminders_list,
@@ -276,86 +770,295 @@ def customer_profile(customer_id):
     )
 
 # ------------------- SEARCH CUSTOMERS -------------------
+SEARCH_PAGE_SIZE = 20
+SNIPPETS_PER_CUSTOMER = 3
+
+# Candidates are the newest SEARCH_MAX_HITS matching customers and messages:
+# FTS5 reads its index in rowid order and stops at the LIMIT, whereas
+# ORDER BY rank has to score every match first (about as slow as no limit
+# for a common word). Candidates are then ranked by bm25 (lowest is best),
+# and a customer's score is that of their best hit. Totals cover the
+# candidates only; total_capped says when more matches were left out.
+SEARCH_MAX_HITS = 1000
+SEARCH_HITS_SQL = '''
+WITH customer_hits AS (
+    SELECT rowid AS customer_id, bm25(customers_fts) AS score
+    FROM customers_fts WHERE customers_fts MATCH :q ORDER BY rowid DESC LIMIT :max_hits
+),
+message_hits AS (
+    SELECT rowid AS message_id, bm25(messages_fts) AS score
+    FROM messages_fts WHERE messages_fts MATCH :q ORDER BY rowid DESC LIMIT :max_hits
+),
+hits AS (
+    SELECT customer_id, score, 0 AS from_message FROM customer_hits
+    UNION ALL
+    SELECT m.customer_id, h.score, 1 FROM message_hits h JOIN messages m ON m.id = h.message_id
+),
+matched AS (
+    SELECT customer_id, MIN(score) AS score, SUM(from_message) AS message_hits, COUNT(*) AS hits
+    FROM hits GROUP BY customer_id
+)
+'''
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{w}"*' for w in words)
+
+def search_customers(conn, query, page=1, per_page=SEARCH_PAGE_SIZE):
+    q = fts_query(query)
+    if not q:
+        # Nothing to match; search() pages the dashboard listing instead
+        customers, customer_orders, _ = dashboard_page(conn)
+        return customers, customer_orders, dashboard_totals(conn), {}
+
+    # One pass over the candidates gives both the totals and the page
+    matched = conn.execute(SEARCH_HITS_SQL + '''
+        SELECT matched.customer_id, matched.hits, matched.message_hits,
+               COALESCE(s.messages_count, 0) AS messages_count, COALESCE(s.orders_count, 0) AS orders_count,
+               COALESCE(s.total_revenue, 0) AS total_revenue
+        FROM matched LEFT JOIN customer_stats s ON s.customer_id = matched.customer_id
+        ORDER BY matched.score, matched.customer_id
+    ''', {'q': q, 'max_hits': SEARCH_MAX_HITS}).fetchall()
+    message_hits = sum(r['message_hits'] for r in matched)
+    totals = {
+        'total_customers': len(matched),
+        'total_messages': sum(r['messages_count'] for r in matched),
+        'total_orders': sum(r['orders_count'] for r in matched),
+        'total_revenue': sum(r['total_revenue'] for r in matched),
+        'total_capped': SEARCH_MAX_HITS in (message_hits, sum(r['hits'] for r in matched) - message_hits),
+    }
+
+    ids = [r['customer_id'] for r in matched[(page - 1) * per_page:page * per_page]]
+    if not ids:
+        return [], {}, totals, {}
+
+    placeholders = ','.join('?' * len(ids))
+    customers, customer_orders = dashboard_customers(conn, f'WHERE c.id IN ({placeholders})', ids)
+    rank = {cid: i for i, cid in enumerate(ids)}
+    customers.sort(key=lambda c: rank[c['id']])
+
+    # Snippets come from the same candidate messages; filtering the FTS
+    # match by rowid list would still walk every match of a long prefix
+    snippets = {}
+    for r in conn.execute(f'''
+        SELECT m.customer_id, m.timestamp, h.snippet
+        FROM (
+            SELECT rowid, bm25(messages_fts) AS score, snippet(messages_fts, 0, '[', ']', '...', 12) AS snippet
+            FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+        ) h JOIN messages m ON m.id = h.rowid
+        WHERE m.customer_id IN ({placeholders})
+        ORDER BY h.score
+    ''', [q, SEARCH_MAX_HITS] + ids):
+        found = snippets.setdefault(r['customer_id'], [])
+        if len(found) < SNIPPETS_PER_CUSTOMER:
+            found.append(dict(r))
+    return customers, customer_orders, totals, snippets
+
 @app.route('/search', methods=['GET'])
 def search():
     query = request.args.get('q', '')
-    conn = get_db_connection()
-    customers = conn.execute(
-        'SELECT * FROM customers WHERE name LIKE ? OR instagram_handle LIKE ?',
-        ('%' + query + '%', '%' + query + '%')
-    ).fetchall()
-    conn.close()
-    return render_template('index.html', customers=customers, total_customers=len(customers), total_messages=0, total_orders=0, customer_orders={}, total_revenue=0)
+    page = max(request.args.get('page', 1, type=int), 1)
+    conn = get_db_connection(readonly=True)
+    next_after = None
+    if fts_query(query):
+        customers, customer_orders, totals, snippets = search_customers(conn, query, page)
+        has_next = page * SEARCH_PAGE_SIZE < totals['total_customers']
+    else:
+        # An empty query lists every customer, paged like the dashboard
+        customers, customer_orders, next_after = dashboard_page(conn, request.args.get('after', 0, type=int))
+        totals, snippets = dict(dashboard_totals(conn), total_capped=False), {}
+        has_next = next_after is not None
+    return render_template(
+        'index.html',
+        customers=customers,
+        customer_orders=customer_orders,
+        snippets=snippets,
+        query=query,
+        page=page,
+        next_after=next_after,
+        has_next=has_next,
+        ai_enabled=os.getenv("AI_ENABLED", "true") == "true",
+        **totals
+    )
 
 # ------------------- EXPORT DATA -------------------
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Tables that can be filtered with since/until (customers has no timestamp)
+TIMESTAMPED_TABLES = {'orders', 'messages'}
+
+def export_batches(path, table, filters=(), params=(), after_id=0, batch_size=EXPORT_BATCH_SIZE, archived=False):
+    """Yield (columns, rows) for `table` in id order, batch_size rows at a time.
+
+    Each batch is its own keyset query (id > last id), so memory stays flat
+    and no read snapshot is held open for the whole export. Uses a dedicated
+    read-only connection because the generator outlives the request. With
+    `archived`, rows moved to the archive database are merged in.
+    """
+    conn = db.open_connection(path, readonly=True)
+    try:
+        where = ' AND '.join(['id > ?'] + list(filters))
+        sql = f'SELECT * FROM main.{table} WHERE {where}'
+        if archived:
+            sql += f' UNION SELECT * FROM archive.{table} WHERE {where}'
+        sql += f' ORDER BY id LIMIT {batch_size}'
+        last_id = after_id
+        while True:
+            cursor = conn.execute(sql, ([last_id] + list(params)) * (2 if archived else 1))
+            rows = cursor.fetchall()
+            yield [d[0] for d in cursor.description], rows
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1]['id']
+    finally:
+        conn.close()
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for i, (columns, rows) in enumerate(batches):
+        if i == 0:
+            writer.writerow(columns)
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def ndjson_chunks(batches):
+    for columns, rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/export/<string:table>')
 def export_table(table):
-    conn = get_db_connection()
+    """Stream a table as CSV or NDJSON, optionally gzipped.
+
+    Query args: format=csv|ndjson, gzip=1, customer_id, since/until
+    (timestamp range, until exclusive) and after_id for incremental syncs:
+    pass the last id from the previous export to only get newer rows.
+    """
     valid_tables = ['customers', 'orders', 'messages']
     if table not in valid_tables:
         return "Invalid table"
-    data = conn.execute(f'SELECT * FROM {table}').fetchall()
-    conn.close()
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
 
-    def generate():
-        yield ','.join(data[0].keys()) + '\n'
-        for row in data:
-            yield ','.join(str(row[k]) for k in row.keys()) + '\n'
+    filters, params = [], []
+    customer_id = request.args.get('customer_id', type=int)
+    if customer_id is not None:
+        filters.append('id = ?' if table == 'customers' else 'customer_id = ?')
+        params.append(customer_id)
+    for arg, op in (('since', '>='), ('until', '<')):
+        value = request.args.get(arg)
+        if value:
+            if table not in TIMESTAMPED_TABLES:
+                return jsonify({"error": f"{table} cannot be filtered by {arg}"}), 400
+            filters.append(f'timestamp {op} ?')
+            params.append(value.replace('T', ' '))
+    after_id = request.args.get('after_id', 0, type=int)
 
-    return Response(generate(), mimetype='text/csv', headers={"Content-Disposition": f"attachment;filename={table}.csv"})
+    batches = export_batches(db.current_path(), table, filters, params, after_id,
+                             archived=ARCHIVE_ENABLED and table in ARCHIVED_TABLES)
+    chunks = csv_chunks(batches) if fmt == 'csv' else ndjson_chunks(batches)
+    filename = f'{table}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
 
-# ------------------- AI REPLY WITH CACHING -------------------
-@app.route('/ai_reply', methods=['POST'])
-def ai_reply():
-    customer_id = request.form.get('customer_id')  # <-- read from form
-    if not customer_id:
-        return jsonify({"error": "Customer ID is required."}), 400
+    return Response(chunks, mimetype=mimetype, headers={"Content-Disposition": f"attachment;filename={filename}"})
 
-    user_message = request.form['message']
-    tone = request.form.get('tone', 'professional')
-   
-    # Check if reply already cached
+# ------------------- BULK INGESTION -------------------
+@app.route('/ingest/<string:kind>', methods=['POST'])
+def ingest_records(kind):
+    """Bulk-load customers, messages or orders from a JSONL or CSV body.
+
+    The body is streamed and written in large batches; rows that fail
+    validation are reported (with their line number) and skipped.
+    """
+    if kind not in ingest.KINDS:
+        return jsonify({"error": f"Unknown kind: {kind}"}), 404
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
     conn = get_db_connection()
-    cached = conn.execute(
-        'SELECT reply FROM ai_replies WHERE customer_id=? AND message=?',
-        (customer_id, user_message)
-    ).fetchone()
-    if cached:
-        conn.close()
-        return jsonify({"reply": cached['reply_text']})
+    report = ingest.ingest(conn, kind, ingest.read_records(stream, fmt))
+    return jsonify(report)
+
+# ------------------- AI REPLY WITH CACHING -------------------
+TONE_PROMPTS = {
+    "professional": "Reply professionally and politely to this customer message:",
+    "friendly": "Reply in a friendly and warm tone:",
+    "sales": "Reply in a persuasive sales-focused tone:",
+    "polite": "Reply politely with a gentle follow-up tone:"
+}
 
-    tone_prompt = {
-        "professional": "Reply professionally and politely to this customer message:",
-        "friendly": "Reply in a friendly and warm tone:",
-        "sales": "Reply in a persuasive sales-focused tone:",
-        "polite": "Reply politely with a gentle follow-up tone:"
-    }.get(tone, "Reply professionally:")
+def generate_reply(conn, customer_id, user_message, tone):
+    """Reply from the cache or the API; runs on a job worker."""
+    tone_prompt = TONE_PROMPTS.get(tone, "Reply professionally:")
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+    def generate():
+        response = ai_client.chat.completions.create(
+            model=AI_MODEL,
             messages=[{"role": "user", "content": f"{tone_prompt} {user_message}"}],
             max_tokens=120
         )
-        ai_text = response.choices[0].message.content
+        return response.choices[0].message.content
 
-        # Cache the reply
+    # Replies are shared across customers: identical questions in the same
+    # tone hit the cache, and concurrent identical requests share one call.
+    try:
+        ai_text, source = reply_cache.get_or_create(
+            conn, ai.reply_cache_key(user_message, tone, AI_MODEL), generate
+        )
+    except ai.RateLimitError:
+        raise  # retried by the job queue
+    except ai.AIError as e:
+        return {"reply": f"AI error: {str(e)}"}
+
+    if source == 'api':
+        # Per-customer history of generated replies
         conn.execute(
             'INSERT INTO ai_replies (customer_id, message, reply) VALUES (?, ?, ?)',
             (customer_id, user_message, ai_text)
         )
-
         conn.commit()
-        conn.close()
+    return {"reply": ai_text, "cached": source != 'api'}
 
-        return jsonify({"reply": ai_text})
+@app.route('/ai_reply', methods=['POST'])
+def ai_reply():
+    """Cached replies are returned directly; otherwise a job id to poll at /jobs/<id>."""
+    customer_id = request.form.get('customer_id')  # <-- read from form
+    if not customer_id:
+        return jsonify({"error": "Customer ID is required."}), 400
 
-    except RateLimitError:
-        conn.close()
-        return jsonify({"reply": "AI quota exceeded. Fallback: please reply manually."})
-    except OpenAIError as e:
-        conn.close()
-        return jsonify({"reply": f"AI error: {str(e)}"})
+    user_message = request.form['message']
+    tone = request.form.get('tone', 'professional')
+
+    conn = get_db_connection()
+    cached, _ = reply_cache.get(conn, ai.reply_cache_key(user_message, tone, AI_MODEL))
+    if cached is not None:
+        metrics.AI_REQUESTS.inc('ai_reply', 'cached')
+        return jsonify({"reply": cached, "cached": True})
+
+    job_id = services().job_queue.enqueue(conn, 'reply', {
+        "customer_id": customer_id, "message": user_message, "tone": tone
+    })
+    metrics.AI_REQUESTS.inc('ai_reply', 'queued')
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@app.route('/ai_reply/cache_stats')
+def ai_reply_cache_stats():
+    return jsonify(reply_cache.stats())
 
 # ------------------- MESSAGE TEMPLATES -------------------
 @app.route('/templates', methods=['GET', 'POST'])
@@ -367,7 +1070,6 @@ def templates():
         conn.execute('INSERT INTO message_templates (name, content) VALUES (?, ?)', (name, content))
         conn.commit()
     templates = conn.execute('SELECT * FROM message_templates').fetchall()
-    conn.close()
     return render_template('templates.html', templates=templates)
 
 # ------------------- AI MESSAGE SUMMARY WITH SAVING -------------------
@@ -377,43 +1079,162 @@ def summary(customer_id):
         return jsonify({"error": "AI features are disabled."}), 403
 
     conn = get_db_connection()
-    messages_list = conn.execute(
-        'SELECT message_text FROM messages WHERE customer_id=? ORDER BY timestamp ASC',
-        (customer_id,)
+    summary_text = ai.current_summary(conn, customer_id)
+    if summary_text is not None:
+        metrics.AI_REQUESTS.inc('summary', 'current')
+        return jsonify({"summary": summary_text})
+
+    # New messages since the last summary: update it in the background
+    job_id = services().job_queue.enqueue(conn, 'summary', {"customer_id": customer_id})
+    metrics.AI_REQUESTS.inc('summary', 'queued')
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+# ------------------- AI JOBS -------------------
+# A waiting request holds a (sync) WSGI worker, so keep waits short and let
+# clients poll again; 30s waits from a few open profiles exhaust the workers.
+JOB_MAX_WAIT = 2
+
+def run_reply_job(conn, payload):
+    return generate_reply(conn, payload['customer_id'], payload['message'], payload['tone'])
+
+def run_summary_job(conn, payload):
+    summary_text, _ = ai.update_summary(conn, ai_client, AI_MODEL, payload['customer_id'])
+    return {"summary": summary_text}
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Job status and result; ?wait=N waits up to N (at most JOB_MAX_WAIT) seconds for completion."""
+    conn = get_db_connection()
+    wait = min(request.args.get('wait', 0, type=float), JOB_MAX_WAIT)
+    job_queue = services().job_queue
+    job_queue.start()  # the job may be waiting for this database's workers to be restarted
+    job = job_queue.wait(conn, job_id, wait) if wait > 0 else job_queue.get(conn, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
+
+def enqueue_activity_summaries(conn, job_queue, since):
+    """Queue summary jobs for every customer with activity since `since`."""
+    rows = conn.execute(
+        'SELECT customer_id FROM customer_stats WHERE last_activity >= ?', (since,)
     ).fetchall()
+    return [job_queue.enqueue(conn, 'summary', {"customer_id": r['customer_id']}) for r in rows]
 
-    all_text = "\n".join([m['message_text'] for m in messages_list])
+def database_paths():
+    """Every database the app serves: one per tenant, or the app's own."""
+    if tenant_router is not None:
+        return [tenant_router.path(tenant) for tenant in tenant_router.tenants()]
+    return [app.config['DATABASE']]
 
-    existing_summary = conn.execute(
-        'SELECT summary_text FROM ai_summaries WHERE customer_id=? ORDER BY timestamp DESC LIMIT 1',
-        (customer_id,)
-    ).fetchone()
-    if existing_summary:
-        conn.close()
-        return jsonify({"summary": existing_summary['summary_text']})
+@app.cli.command('precompute-summaries')
+@click.option('--hours', default=24, help='Summarize customers active in the last N hours.')
+def precompute_summaries(hours):
+    """Refresh AI summaries for recently active customers (e.g. nightly)."""
+    for path in database_paths():
+        conn = db.pooled_connection(path)
+        since = conn.execute("SELECT datetime('now', ?)", (f'-{hours} hours',)).fetchone()[0]
+        job_queue = services(path).job_queue
+        job_ids = enqueue_activity_summaries(conn, job_queue, since)
+        job_queue.start()
+        job_queue.drain(conn)
+        click.echo(f"Refreshed {len(job_ids)} summaries in {path}.")
+    stop_services()
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": f"Summarize these messages:\n{all_text}"}],
-            max_tokens=150
-        )
-        summary_text = response.choices[0].message.content
-        conn.execute(
-            'INSERT INTO ai_summaries (customer_id, summary_text, timestamp) VALUES (?, ?, ?)',
-            (customer_id, summary_text, datetime.now().isoformat())
-        )
-        conn.commit()
-        conn.close()
-        return jsonify({"summary": summary_text})
+# ------------------- METRICS -------------------
+def collect_app_metrics():
+    stats = reply_cache.stats()
+    yield ('crm_ai_reply_cache_lookups_total', 'counter', 'AI reply cache lookups by result.',
+           [({'result': result}, stats[result]) for result in ('memory_hits', 'db_hits', 'coalesced', 'misses')])
+    yield ('crm_ai_reply_cache_hit_ratio', 'gauge', 'Share of AI reply cache lookups served from cache.',
+           [({}, stats['hit_rate'])])
+    yield ('crm_ai_reply_cache_items', 'gauge', 'AI replies held in memory.', [({}, stats['size'])])
+    pages = rendered_pages.stats()
+    yield ('crm_page_cache_requests_total', 'counter', 'Cached page requests by result.',
+           [({'result': result}, pages[result]) for result in ('hits', 'misses', 'not_modified')])
+    yield ('crm_page_cache_items', 'gauge', 'Rendered pages held in memory.', [({}, pages['size'])])
+    if tenant_router is None:
+        # Per-tenant job tables are not scanned on every scrape
+        conn = get_db_connection(readonly=True)
+        yield ('crm_ai_jobs', 'gauge', 'AI jobs by status.',
+               [({'status': r['status']}, r['n']) for r in
+                conn.execute('SELECT status, COUNT(*) AS n FROM ai_jobs GROUP BY status')])
+    if WRITE_BEHIND:
+        with _services_lock:
+            writers = [s.group_writer.stats() for s in _services.values()]
+        yield ('crm_group_commit_writes_total', 'counter', 'Writes committed by the group-commit writer.',
+               [({}, sum(w['writes'] for w in writers))])
+        yield ('crm_group_commit_batches_total', 'counter', 'Group-commit transactions.',
+               [({}, sum(w['batches'] for w in writers))])
 
-    except RateLimitError:
-        conn.close()
-        return jsonify({"error": "AI quota exceeded. Please try later."}), 429
-    except OpenAIError as e:
+if METRICS_ENABLED:
+    metrics.register_collector(collect_app_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled."}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ------------------- TENANT ADMIN -------------------
+def tenant_totals(conn):
+    totals = dashboard_totals(conn)
+    totals['size_bytes'] = conn.execute(
+        'SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()'
+    ).fetchone()[0]
+    return totals
+
+@app.route('/admin/tenants')
+def admin_tenants():
+    """Dashboard totals of every tenant, read from all databases in parallel.
+
+    Needs ADMIN_TOKEN set and sent as a bearer token.
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if tenant_router is None or not token:
+        return jsonify({"error": "Tenant administration is disabled."}), 404
+    if request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({"error": "Unauthorized."}), 401
+    results = tenants.fan_out(tenant_router, tenant_totals, workers=int(os.getenv("TENANT_ADMIN_WORKERS", "8")))
+    totals = {}
+    for result in results.values():
+        if 'error' not in result:
+            for name, value in result.items():
+                totals[name] = totals.get(name, 0) + value
+    return jsonify({"tenants": results, "totals": totals})
+
+# ------------------- APP FACTORY -------------------
+def create_app():
+    """Return the app for a WSGI server (see wsgi.py).
+
+    Settings come from the environment (and .env). Fails fast if the
+    database (or any tenant's) has not been migrated; connections and
+    background threads are opened by each worker on first use, never before
+    it forks.
+    """
+    if tenant_router is not None:
+        outdated = tenant_router.outdated()
+        if outdated:
+            raise RuntimeError(f"Tenant databases need migrating: {', '.join(outdated)}; "
+                               f"run python tenants.py migrate --dir {tenant_router.directory}")
+        return app
+    path = app.config['DATABASE']
+    if not os.path.exists(path):
+        raise RuntimeError(f"{path} does not exist; run python init_db.py --db {path}")
+    conn = db.open_connection(path, readonly=True)
+    try:
+        version = schema_version(conn)
+    finally:
         conn.close()
-        return jsonify({"error": f"AI service error: {str(e)}"}), 500
+    if version < len(MIGRATIONS):
+        raise RuntimeError(f"{path} is at schema version {version} of {len(MIGRATIONS)}; "
+                           f"run python init_db.py --db {path}")
+    return app
 
 # ------------------- RUN APP -------------------
+# Development server only; use wsgi.py in production.
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "5000")),
+        debug=os.getenv("FLASK_DEBUG", "true") == "true"
+    )
@@ -0,0 +1,273 @@
+"""Hot/cold archival of old messages and activity history.
+
+Rows older than --days move from the main database into an archive
+database next to it (crm_archive.db for crm.db), which the app attaches to
+every connection as schema "archive" and reads through when older history
+is requested. Keeping only recent rows in the main database keeps it small
+enough to stay in the page cache.
+
+Rows move in batches: each batch is copied to the archive and committed,
+then deleted from the main database and committed. A run can be stopped and
+started again at any point; a batch interrupted between the two commits is
+finished by the next run.
+
+    python archive.py --db crm.db --days 365 --retention-days 1825 --compact
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+import db
+import page_cache
+from init_db import ARCHIVED_TABLES, CATEGORY_SQL, add_to_rollups, compact as compact_main
+
+BATCH_SIZE = 5000
+
+# Same columns, in the same order, as the main tables so rows can be
+# combined with UNION. No foreign keys: customers live in the main database.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER,
+    message_text TEXT,
+    direction TEXT,
+    timestamp DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_messages_customer_ts ON messages(customer_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(timestamp);
+
+CREATE TABLE IF NOT EXISTS activity_timeline (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER,
+    action TEXT,
+    timestamp DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_activity_customer_ts ON activity_timeline(customer_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_activity_ts ON activity_timeline(timestamp);
+'''
+
+
+def default_path(db_path):
+    root, ext = os.path.splitext(db_path)
+    return f'{root}_archive{ext or ".db"}'
+
+
+def init_archive(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')  # only takes effect on a new file
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    conn.close()
+
+
+def enable(path=None):
+    """Attach an archive to every new connection, creating it if needed.
+
+    Without `path` each database gets its own archive next to it (see
+    default_path), so every tenant's history stays in its own files.
+    """
+    if path:
+        init_archive(path)
+        db.attached['archive'] = path
+    else:
+        db.attached['archive'] = _archive_for
+
+
+_initialized = set()
+
+
+def _archive_for(db_path):
+    path = default_path(db_path)
+    if path not in _initialized:
+        init_archive(path)
+        _initialized.add(path)
+    return path
+
+
+def attach(conn, path):
+    """Attach an existing archive to `conn`; returns False if there is none."""
+    if not os.path.exists(path):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    return True
+
+
+def is_attached(conn):
+    return any(r[1] == 'archive' for r in conn.execute('PRAGMA database_list'))
+
+
+# ------------------- READ-THROUGH -------------------
+def horizon(conn, table):
+    """Newest archived timestamp of `table` (one index lookup), or None."""
+    return conn.execute(f'SELECT MAX(timestamp) FROM archive.{table}').fetchone()[0]
+
+
+def timeline(conn, table, customer_id, position=None, limit=50):
+    """Newest-first rows of a customer's hot and archived history before `position`."""
+    where = 'customer_id=?'
+    params = [customer_id]
+    if position:
+        where += ' AND (timestamp, id) < (?, ?)'
+        params += list(position)
+    return conn.execute(
+        f'SELECT * FROM main.{table} WHERE {where} UNION SELECT * FROM archive.{table} WHERE {where} '
+        'ORDER BY timestamp DESC, id DESC LIMIT ?',
+        params + params + [limit]
+    ).fetchall()
+
+
+# ------------------- CUSTOMER CHANGES -------------------
+# Archived rows have no foreign keys or triggers, so deletes and merges of
+# customers are applied to them explicitly, and what the main database's
+# triggers would do for a delete is done here.
+
+# customer_stats counters that include archived rows, by table
+ARCHIVED_STATS = {'messages': 'messages_count'}
+
+
+def _delete_archived(conn, table, where, params=()):
+    """Delete archived rows of `table` matching `where`, in the caller's transaction.
+
+    The rows are subtracted from the rollups and customer_stats, and the
+    pages showing them are marked changed. Rows still in the main database
+    too (an interrupted archive run) are counted by its triggers, so they
+    are not subtracted twice.
+    """
+    where = f'({where})'
+    params = list(params)
+    counted = f'{where} AND r.id NOT IN (SELECT id FROM main.{table})'
+    add_to_rollups(conn, table, f'archive.{table}', counted, params, sign='-')
+    column = ARCHIVED_STATS.get(table)
+    if column:
+        customers = f'SELECT customer_id FROM archive.{table} r WHERE {counted}'
+        conn.execute(
+            f'UPDATE customer_stats SET {column} = {column} - (SELECT COUNT(*) FROM archive.{table} r '
+            f'WHERE {counted} AND r.customer_id = customer_stats.customer_id) '
+            f'WHERE customer_id IN ({customers})',
+            params + params
+        )
+        conn.execute(f'UPDATE customer_stats SET category = {CATEGORY_SQL} WHERE customer_id IN ({customers})',
+                     params)
+    page_cache.bump(conn, f'SELECT DISTINCT customer_id FROM archive.{table} r WHERE {where}', params)
+    return conn.execute(f'DELETE FROM archive.{table} WHERE {where}', params).rowcount
+
+
+def forget_customers(conn, customer_ids):
+    """Delete the archived history of customers; call before deleting them from the main database."""
+    if not customer_ids or not is_attached(conn):
+        return
+    placeholders = ','.join('?' * len(customer_ids))
+    for table in ARCHIVED_TABLES:
+        _delete_archived(conn, table, f'customer_id IN ({placeholders})', list(customer_ids))
+
+
+def move_customers(conn, target_id, source_ids):
+    if not source_ids or not is_attached(conn):
+        return
+    placeholders = ','.join('?' * len(source_ids))
+    for table in ARCHIVED_TABLES:
+        conn.execute(f'UPDATE archive.{table} SET customer_id=? WHERE customer_id IN ({placeholders})',
+                     [target_id, *source_ids])
+
+
+# ------------------- ARCHIVING -------------------
+def archive_table(conn, table, before, batch_size=BATCH_SIZE):
+    """Move rows of `table` with a timestamp before `before` to the archive. Returns rows moved."""
+    moved = 0
+    last_id = 0
+    while True:
+        ids = [r[0] for r in conn.execute(
+            f'SELECT id FROM main.{table} WHERE id > ? AND timestamp < ? ORDER BY id LIMIT ?',
+            (last_id, before, batch_size)
+        )]
+        if not ids:
+            return moved
+        placeholders = ','.join('?' * len(ids))
+        # The two files commit separately, so copy first: a crash in between
+        # leaves rows in both, never in neither. OR REPLACE refreshes copies
+        # left behind by an earlier interrupted run.
+        conn.execute(f'INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE id IN ({placeholders})',
+                     ids)
+        conn.commit()
+        conn.execute('INSERT INTO archive_running (running) VALUES (1)')
+        # Rows merged onto another customer since the copy stay hot until the next run
+        moved += conn.execute(
+            f'DELETE FROM main.{table} WHERE id IN ({placeholders}) AND customer_id IS '
+            f'(SELECT a.customer_id FROM archive.{table} a WHERE a.id = main.{table}.id)',
+            ids
+        ).rowcount
+        conn.execute('DELETE FROM archive_running')
+        conn.commit()
+        last_id = ids[-1]
+
+
+def purge_table(conn, table, before, batch_size=BATCH_SIZE):
+    """Retention: permanently delete archived rows older than `before`. Returns rows deleted."""
+    deleted = 0
+    while True:
+        ids = [r[0] for r in conn.execute(
+            f'SELECT id FROM archive.{table} WHERE timestamp < ? ORDER BY id LIMIT ?', (before, batch_size)
+        )]
+        if ids:
+            deleted += _delete_archived(conn, table, f"id IN ({','.join('?' * len(ids))})", ids)
+            conn.commit()
+        if len(ids) < batch_size:
+            return deleted
+
+
+def compact(conn):
+    """Drop archived rows of deleted customers and reclaim space in both databases.
+
+    Returns bytes freed in the archive."""
+    for table in ARCHIVED_TABLES:
+        _delete_archived(conn, table, 'customer_id NOT IN (SELECT id FROM main.customers)')
+    conn.commit()
+    page_size = conn.execute('PRAGMA archive.page_size').fetchone()[0]
+    before = conn.execute('PRAGMA archive.page_count').fetchone()[0]
+    conn.execute('PRAGMA archive.incremental_vacuum')
+    after = conn.execute('PRAGMA archive.page_count').fetchone()[0]
+    compact_main(conn)
+    return (before - after) * page_size
+
+
+def run(conn, days, retention_days=0, batch_size=BATCH_SIZE):
+    """Archive rows older than `days` and, if retention_days is set, purge
+    archived rows older than that. Returns {table: {'archived': n, 'purged': n}}."""
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{days} days',)).fetchone()[0]
+    report = {}
+    for table in ARCHIVED_TABLES:
+        report[table] = {'archived': archive_table(conn, table, cutoff, batch_size), 'purged': 0}
+        if retention_days:
+            expired = conn.execute("SELECT datetime('now', ?)", (f'-{retention_days} days',)).fetchone()[0]
+            report[table]['purged'] = purge_table(conn, table, expired, batch_size)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=db.DB)
+    parser.add_argument('--archive', help='archive database (default: <db>_archive.db)')
+    parser.add_argument('--days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', '365')),
+                        help='archive rows older than this')
+    parser.add_argument('--retention-days', type=int, default=int(os.getenv('ARCHIVE_RETENTION_DAYS', '0')),
+                        help='delete archived rows older than this (0 keeps them forever)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--compact', action='store_true', help='reclaim freed space afterwards')
+    args = parser.parse_args()
+
+    path = args.archive or default_path(args.db)
+    init_archive(path)
+    db.attached['archive'] = path
+    conn = db.open_connection(args.db)
+    started = time.perf_counter()
+    for table, counts in run(conn, args.days, args.retention_days, args.batch_size).items():
+        print(f"{table}: archived {counts['archived']}, purged {counts['purged']}")
+    if args.compact:
+        print(f"Reclaimed {compact(conn) / 1024 / 1024:.1f} MB in the archive.")
+    conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
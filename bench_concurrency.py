@@ -0,0 +1,155 @@
+"""Concurrency benchmark: dashboard reads while agents log messages.
+
+Runs the same workload twice against a scratch database:
+
+* legacy - a fresh sqlite3.connect() per operation, rollback journal
+* pooled - per-thread pooled connections from db.py (WAL, busy_timeout, ...)
+
+and prints read latency percentiles, write throughput and lock errors.
+
+    python bench_concurrency.py --customers 2000 --writers 4 --readers 4 --seconds 5
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import db
+from init_db import init_db
+
+DASHBOARD_SQL = '''
+SELECT c.id, COALESCE(s.orders_count, 0), COALESCE(s.messages_count, 0), COALESCE(s.category, 'Lead')
+FROM customers c LEFT JOIN customer_stats s ON s.customer_id = c.id
+'''
+
+
+def seed(path, customers):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO customers (name, instagram_handle) VALUES (?, ?)',
+        ((f'Customer {i}', f'customer_{i}') for i in range(customers))
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_connection(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def run(path, mode, customers, writers, readers, seconds):
+    stop = threading.Event()
+    read_latencies = []
+    writes = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def connection():
+        if mode == 'legacy':
+            return legacy_connection(path)
+        return db.pooled_connection(path)
+
+    def release(conn):
+        if mode == 'legacy':
+            conn.close()
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            customer_id = (n * 7919 + i) % customers + 1
+            i += 1
+            conn = connection()
+            try:
+                conn.execute(
+                    'INSERT INTO messages (customer_id, message_text, direction) VALUES (?, ?, ?)',
+                    (customer_id, 'is this available?', 'inbound')
+                )
+                conn.execute(
+                    'INSERT INTO customer_stats (customer_id, messages_count) VALUES (?, 1) '
+                    'ON CONFLICT(customer_id) DO UPDATE SET messages_count = messages_count + 1',
+                    (customer_id,)
+                )
+                conn.commit()
+                with lock:
+                    writes[0] += 1
+            except sqlite3.OperationalError:
+                conn.rollback()
+                with lock:
+                    errors[0] += 1
+            finally:
+                release(conn)
+        if mode == 'pooled':
+            db.close_thread_connections()
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            conn = connection()
+            try:
+                conn.execute(DASHBOARD_SQL).fetchall()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    read_latencies.append(elapsed)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+            finally:
+                release(conn)
+        if mode == 'pooled':
+            db.close_thread_connections()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    read_latencies.sort()
+
+    def pct(p):
+        if not read_latencies:
+            return float('nan')
+        return read_latencies[min(len(read_latencies) - 1, int(len(read_latencies) * p))] * 1000
+
+    return {
+        'mode': mode,
+        'reads/s': len(read_latencies) / seconds,
+        'writes/s': writes[0] / seconds,
+        'read p50 ms': statistics.median(read_latencies) * 1000 if read_latencies else float('nan'),
+        'read p95 ms': pct(0.95),
+        'read p99 ms': pct(0.99),
+        'lock errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('legacy', 'pooled'):
+            path = os.path.join(tmp, f'{mode}.db')
+            init_db(path)
+            if mode == 'legacy':
+                conn = sqlite3.connect(path)
+                conn.execute('PRAGMA journal_mode=DELETE')
+                conn.close()
+            seed(path, args.customers)
+            result = run(path, mode, args.customers, args.writers, args.readers, args.seconds)
+            print('  '.join(f'{k}={v:.2f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
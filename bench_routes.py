@@ -0,0 +1,284 @@
+"""Route benchmark: every endpoint in app.py through the Flask test client.
+
+Generates a database with gen_data.py (or reuses --db), stubs the OpenAI
+client with ai.FakeClient, then sends --requests requests to each endpoint
+and reports requests/s, p50/p95/p99 latency, SQL statements per request and
+the status codes seen. Results are saved as JSON; --compare diffs a run
+against an earlier one and exits 1 if any endpoint's p99 regressed by more
+than --threshold percent. Any 5xx response also fails the run.
+
+    python bench_routes.py --scale 100k --output baseline.json
+    python bench_routes.py --db bench.db --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+import gen_data
+
+SEARCH_TERMS = ('stock', 'price', 'khan', 'ayesha', 'order', 'deliv')
+
+
+# ------------------- ENDPOINTS -------------------
+class Context:
+    """Ids the endpoint builders draw from; destructive endpoints use victims."""
+
+    def __init__(self, conn, rng, victims):
+        self.rng = rng
+        self.customers = [tuple(r) for r in conn.execute(
+            'SELECT id, instagram_handle FROM customers ORDER BY random() LIMIT 1000'
+        )]
+        self.victims = victims
+        self.job_ids = []
+        self.rule_ids = []
+        self.counter = 0
+
+    def customer(self):
+        return self.rng.choice(self.customers)
+
+    def customer_id(self):
+        return self.customer()[0]
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+
+def _edit(ctx):
+    customer_id, handle = ctx.customer()
+    return 'POST', f'/edit/{customer_id}', {'data': {'name': f'Bench {ctx.next()}', 'instagram_handle': handle}}
+
+
+def _ingest(ctx):
+    body = '\n'.join(json.dumps({'customer_id': ctx.customer_id(), 'message_text': 'is this in stock?'})
+                     for _ in range(100))
+    return 'POST', '/ingest/messages', {'data': body, 'content_type': 'application/x-ndjson'}
+
+
+def _keep_job(ctx, response):
+    job_id = (response.get_json(silent=True) or {}).get('job_id')
+    if job_id:
+        ctx.job_ids.append(job_id)
+
+
+def _keep_rule(ctx, response):
+    rules = (response.get_json(silent=True) or {}).get('rules', [])
+    ctx.rule_ids.extend(r['id'] for r in rules if r['tag'] == 'Bench' and r['id'] not in ctx.rule_ids)
+
+
+# (name, builder(ctx) -> (method, url, test client kwargs), after(ctx, response) or None)
+ENDPOINTS = [
+    ('dashboard', lambda ctx: ('GET', '/', {}), None),
+    ('dashboard_page', lambda ctx: ('GET', f'/?after={ctx.customer_id()}', {}), None),
+    ('add_form', lambda ctx: ('GET', '/add', {}), None),
+    ('edit_form', lambda ctx: ('GET', f'/edit/{ctx.customer_id()}', {}), None),
+    ('messages', lambda ctx: ('GET', f'/messages/{ctx.customer_id()}', {}), None),
+    ('orders', lambda ctx: ('GET', f'/orders/{ctx.customer_id()}', {}), None),
+    ('reminders', lambda ctx: ('GET', f'/reminders/{ctx.customer_id()}', {}), None),
+    ('profile', lambda ctx: ('GET', f'/customer/{ctx.customer_id()}', {}), None),
+    ('history', lambda ctx: ('GET', f'/history/messages/{ctx.customer_id()}', {}), None),
+    ('search', lambda ctx: ('GET', f'/search?q={ctx.rng.choice(SEARCH_TERMS)}', {}), None),
+    ('search_all', lambda ctx: ('GET', '/search', {}), None),
+    ('export_customer', lambda ctx: ('GET', f'/export/messages?format=ndjson&customer_id={ctx.customer_id()}', {}),
+     None),
+    ('tag_rules', lambda ctx: ('GET', '/tag_rules', {}), None),
+    ('templates', lambda ctx: ('GET', '/templates', {}), None),
+    ('ai_cache_stats', lambda ctx: ('GET', '/ai_reply/cache_stats', {}), None),
+    ('page_cache_stats', lambda ctx: ('GET', '/page_cache/stats', {}), None),
+    ('analytics_summary', lambda ctx: ('GET', '/analytics/summary', {}), None),
+    ('analytics_series', lambda ctx: ('GET', '/analytics/revenue?bucket=week&split=1', {}), None),
+    ('add', lambda ctx: ('POST', '/add', {'data': {'name': 'Bench', 'instagram_handle': f'bench_new_{ctx.next()}'}}),
+     None),
+    ('edit', _edit, None),
+    ('message_post', lambda ctx: ('POST', f'/messages/{ctx.customer_id()}',
+                                  {'data': {'message': 'what is the price?', 'direction': 'inbound'}}), None),
+    ('order_post', lambda ctx: ('POST', f'/orders/{ctx.customer_id()}',
+                                {'data': {'product_name': 'Scarf', 'quantity': '1', 'price': '25'}}), None),
+    ('reminder_post', lambda ctx: ('POST', f'/reminders/{ctx.customer_id()}', {'data': {
+        'reminder_text': 'Follow up', 'reminder_date': (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')}}),
+     None),
+    ('template_post', lambda ctx: ('POST', '/templates', {'data': {'name': 'Bench', 'content': 'Hi!'}}), None),
+    ('tag_rule_post', lambda ctx: ('POST', '/tag_rules', {'data': {'tag': 'Bench', 'keyword': f'bench{ctx.next()}'}}),
+     _keep_rule),
+    ('tag_rule_delete', lambda ctx: ('POST', f'/tag_rules/delete/{ctx.rule_ids.pop() if ctx.rule_ids else 0}', {}),
+     None),
+    ('ingest_100', _ingest, None),
+    ('ai_reply', lambda ctx: ('POST', '/ai_reply', {'data': {
+        'customer_id': str(ctx.customer_id()), 'message': f'is item {ctx.rng.randrange(50)} available?'}}),
+     _keep_job),
+    ('summary', lambda ctx: ('GET', f'/summary/{ctx.customer_id()}', {}), _keep_job),
+    ('job_status', lambda ctx: ('GET', f'/jobs/{ctx.rng.choice(ctx.job_ids) if ctx.job_ids else 0}', {}), None),
+    ('delete', lambda ctx: ('POST', f'/delete/{ctx.victims.pop()}', {}), None),
+    ('batch_delete', lambda ctx: ('POST', '/customers/delete', {'json': {'ids': [ctx.victims.pop(), ctx.victims.pop()]}}),
+     None),
+    ('merge', lambda ctx: ('POST', '/customers/merge', {'json': {'into': ctx.victims.pop(), 'ids': [ctx.victims.pop()]}}),
+     None),
+]
+VICTIMS_PER_REQUEST = 5  # delete + batch_delete + merge
+
+
+def add_victims(path, count):
+    conn = sqlite3.connect(path)
+    run = int(time.time())
+    start = conn.execute('SELECT COALESCE(MAX(id), 0) FROM customers').fetchone()[0] + 1
+    conn.executemany(
+        'INSERT INTO customers (id, name, instagram_handle) VALUES (?, ?, ?)',
+        [(start + i, 'Victim', f'bench_victim_{run}_{i}') for i in range(count)]
+    )
+    conn.execute("INSERT INTO messages (customer_id, message_text) SELECT id, 'hello' FROM customers WHERE id >= ?",
+                 (start,))
+    conn.commit()
+    conn.close()
+    return list(range(start, start + count))
+
+
+# ------------------- MEASUREMENT -------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run(crm, ctx, requests, warmup, sql_counter):
+    client = crm.app.test_client()
+    results = {}
+    for name, build, after in ENDPOINTS:
+        latencies, statements, statuses = [], [], {}
+        for i in range(warmup + requests):
+            method, url, kwargs = build(ctx)
+            sql_counter[0] = 0
+            start = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()  # drain streamed bodies
+            elapsed = time.perf_counter() - start
+            if after:
+                after(ctx, response)
+            if i < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            statements.append(sql_counter[0])
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        latencies.sort()
+        results[name] = {
+            'requests': requests,
+            'rps': requests / (sum(latencies) / 1000) if latencies else 0.0,
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'sql_per_request': sum(statements) / len(statements),
+            'status': statuses,
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print per-endpoint changes against a baseline; returns regressed endpoint names."""
+    regressions = []
+    print(f"\n{'endpoint':<18}{'p50 ms':>18}{'p99 ms':>20}{'sql/req':>14}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = (now['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100 if before['p99_ms'] else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<18}{before['p50_ms']:>8.2f} -> {now['p50_ms']:<7.2f}{before['p99_ms']:>9.2f} -> {now['p99_ms']:<7.2f}"
+              f"({change:+.0f}%){before['sql_per_request']:>6.1f} -> {now['sql_per_request']:<5.1f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='benchmark an existing database (a copy is not made)')
+    parser.add_argument('--scale', choices=gen_data.SCALES, default='1k', help='size of the generated database')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=20, help='p99 regression threshold in percent')
+    args = parser.parse_args()
+
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, 'bench.db')
+        print(f"Generating {args.scale} database...", file=sys.stderr)
+        gen_data.generate(path, gen_data.SCALES[args.scale], seed=args.seed)
+    conn = sqlite3.connect(path)
+    customers = conn.execute('SELECT COUNT(*) FROM customers').fetchone()[0]
+    conn.close()
+    victims = add_victims(path, (args.requests + args.warmup) * VICTIMS_PER_REQUEST)
+
+    # Count the SQL statements each request runs on the benchmark thread
+    # (background AI workers are excluded); trigger bodies are not counted.
+    sql_counter = [0]
+    bench_thread = threading.get_ident()
+
+    def trace(statement):
+        if threading.get_ident() == bench_thread and not statement.startswith('--'):
+            sql_counter[0] += 1
+
+    db.connection_hooks.append(lambda conn: conn.set_trace_callback(trace))
+    os.environ.setdefault('AI_FAKE_LATENCY', '0')
+    os.environ['CRM_DB'] = path
+    import app as crm
+    crm.app.logger.disabled = True
+    # The HTML templates are not part of the repo; time the route without
+    # rendering, as the tests do (conftest.py)
+    crm.render_template = lambda name, **context: name
+
+    conn = sqlite3.connect(path)
+    ctx = Context(conn, random.Random(args.seed), victims)
+    conn.close()
+    results = run(crm, ctx, args.requests, args.warmup, sql_counter)
+    crm.stop_services()
+
+    # Timings of failing requests say nothing about the route; flag them and fail the run
+    errors = [name for name, r in results.items() if any(code.startswith('5') for code in r['status'])]
+    print(f"{'endpoint':<18}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql/req':>9}  status")
+    for name, r in results.items():
+        print(f"{name:<18}{r['rps']:>9.0f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['sql_per_request']:>9.1f}  {' '.join(f'{k}x{v}' for k, v in sorted(r['status'].items()))}"
+              f"{'  SERVER ERROR' if name in errors else ''}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'date': datetime.now().isoformat(timespec='seconds'),
+                    'customers': customers,
+                    'requests': args.requests,
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                },
+                'endpoints': results,
+            }, f, indent=2)
+    if tmp is not None:
+        tmp.cleanup()
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['endpoints'], args.threshold)
+        if regressions:
+            print(f"\np99 regressed by more than {args.threshold:.0f}%: {', '.join(regressions)}")
+    if errors:
+        print(f"\n5xx responses from: {', '.join(errors)}")
+    if regressions or errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
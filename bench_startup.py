@@ -0,0 +1,83 @@
+"""Startup benchmark: how fast and how big a fresh worker is.
+
+Starts a new interpreter per run that imports wsgi.py (the app plus
+create_app) against a scratch database, and prints the median import time,
+peak memory and the heavy optional modules it loaded. The bare interpreter
+is measured too, so the app's own share is visible.
+
+    python bench_startup.py --runs 5 --max-seconds 1.0 --max-mb 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from init_db import init_db
+
+HEAVY_MODULES = ('openai', 'httpx', 'pydantic')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+except ImportError:
+    rss_mb = None
+print(json.dumps({{'seconds': seconds, 'rss_mb': rss_mb, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(statement, env, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD.format(statement=statement, heavy=HEAVY_MODULES)],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    rss = [r['rss_mb'] for r in results if r['rss_mb'] is not None]
+    return {
+        'seconds': statistics.median(r['seconds'] for r in results),
+        'rss_mb': statistics.median(rss) if rss else None,
+        'loaded': results[-1]['loaded'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, help='exit non-zero if the app imports slower than this')
+    parser.add_argument('--max-mb', type=float, help='exit non-zero if a worker uses more memory than this')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.db')
+        init_db(path)
+        # A production-like environment without test shortcuts such as AI_FAKE_LATENCY
+        env = {k: v for k, v in os.environ.items() if k != 'AI_FAKE_LATENCY'}
+        env.update(CRM_DB=path, OPENAI_API_KEY=env.get('OPENAI_API_KEY', 'sk-startup-benchmark'))
+        baseline = measure('pass', env, args.runs)
+        app = measure('import wsgi', env, args.runs)
+
+    print(f"interpreter: {baseline['seconds']:.3f}s, {baseline['rss_mb'] or 0:.1f} MB")
+    print(f"app worker:  {app['seconds']:.3f}s, {app['rss_mb'] or 0:.1f} MB; "
+          f"heavy modules loaded: {', '.join(app['loaded']) or 'none'}")
+
+    failed = False
+    if args.max_seconds is not None and app['seconds'] > args.max_seconds:
+        print(f"Startup {app['seconds']:.3f}s exceeds {args.max_seconds}s")
+        failed = True
+    if args.max_mb is not None and app['rss_mb'] is not None and app['rss_mb'] > args.max_mb:
+        print(f"Worker memory {app['rss_mb']:.1f} MB exceeds {args.max_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Write benchmark: many agents logging messages at once.
+
+Runs the message-logging write path (app.record_message) from concurrent
+writer threads against a scratch database, twice:
+
+* inline      - each writer commits on its own pooled connection
+* write-behind - writes go through group_commit.GroupCommitWriter
+
+and prints requests/s, latency percentiles and errors for each. With
+--tenants N the writers are spread over N separate databases, as in
+multi-tenant mode (see tenants.py), each with its own write lock.
+
+    python bench_writes.py --writers 50 --seconds 5 --synchronous FULL
+    python bench_writes.py --writers 50 --tenants 8
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AI_FAKE_LATENCY', '0')
+
+import db
+import group_commit
+from init_db import init_db
+
+MESSAGES = ('is this available?', 'what is the price', 'I want to order two', 'thanks!')
+
+
+def seed(path, customers):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO customers (name, instagram_handle) VALUES (?, ?)',
+        ((f'Customer {i}', f'customer_{i}') for i in range(customers))
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(paths, mode, customers, writers, seconds, batch_size, batch_ms, synchronous):
+    from app import record_message
+
+    stop = threading.Event()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    group_writers = {}
+    if mode == 'write-behind':
+        group_writers = {path: group_commit.GroupCommitWriter(path, max_batch=batch_size, max_delay=batch_ms / 1000,
+                                                          synchronous=synchronous)
+                         for path in paths}
+
+    def agent(n):
+        path = paths[n % len(paths)]
+        writer = group_writers.get(path)
+        conn = db.pooled_connection(path)
+        i = 0
+        while not stop.is_set():
+            customer_id = (n * 7919 + i) % customers + 1
+            text = MESSAGES[i % len(MESSAGES)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                if writer is not None:
+                    writer.write(record_message, customer_id, text, 'inbound')
+                else:
+                    record_message(conn, customer_id, text, 'inbound')
+                    conn.commit()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.rollback()
+                with lock:
+                    errors[0] += 1
+        db.close_thread_connections()
+
+    threads = [threading.Thread(target=agent, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    for writer in group_writers.values():
+        writer.stop()
+
+    latencies.sort()
+
+    def pct(p):
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    result = {
+        'mode': mode,
+        'databases': len(paths),
+        'requests/s': len(latencies) / seconds,
+        'p50 ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p95 ms': pct(0.95),
+        'p99 ms': pct(0.99),
+        'errors': errors[0],
+    }
+    if group_writers:
+        stats = [w.stats() for w in group_writers.values()]
+        batches = sum(s['batches'] for s in stats)
+        result['avg batch'] = sum(s['writes'] for s in stats) / batches if batches else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--batch-ms', type=float, default=2)
+    parser.add_argument('--tenants', type=int, default=1, help='spread the writers over this many databases')
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'], default='NORMAL',
+                        help='FULL fsyncs on every commit, like a rollback-journal database')
+    args = parser.parse_args()
+
+    db.PRAGMAS = tuple(p for p in db.PRAGMAS if 'synchronous' not in p) + (f'PRAGMA synchronous={args.synchronous}',)
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('inline', 'write-behind'):
+            paths = [os.path.join(tmp, f'{mode}-{n}.db') for n in range(args.tenants)]
+            for path in paths:
+                init_db(path)
+                seed(path, args.customers)
+            result = run(paths, mode, args.customers, args.writers, args.seconds, args.batch_size, args.batch_ms,
+                         args.synchronous)
+            print('  '.join(f'{k}={v:.2f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+# The app reads its settings at import time: use the offline AI client with
+# a little latency, and no background reminder thread.
+os.environ['AI_FAKE_LATENCY'] = '0.2'
+os.environ['REMINDER_SCHEDULER'] = 'false'
+os.environ.pop('TENANTS_DIR', None)
+os.environ.pop('WRITE_BEHIND', None)
+
+import db
+import gen_data
+
+
+@pytest.fixture
+def crm(tmp_path, monkeypatch):
+    """The app module, serving a fresh database in tmp_path.
+
+    crm.seed(n) adds n generated customers to the configured database.
+    """
+    import app
+
+    path = str(tmp_path / 'crm.db')
+    gen_data.generate(path, 0)
+    monkeypatch.setitem(app.app.config, 'DATABASE', path)
+    monkeypatch.setattr(app, 'render_template', lambda name, **context: name)
+    app.rendered_pages.clear()
+    monkeypatch.setattr(app, 'seed', lambda customers: gen_data.generate(app.app.config['DATABASE'], customers),
+                        raising=False)
+    yield app
+    app.stop_services()
+    db.close_thread_connections()
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g
+
+DB = 'crm.db'
+
+# Applied to every connection. journal_mode=WAL is persisted in the database
+# file, so readers no longer block on writers (and vice versa).
+PRAGMAS = (
+    'PRAGMA foreign_keys=ON',       # ON DELETE CASCADE from customers
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',     # ~16 MB page cache per connection
+    'PRAGMA mmap_size=268435456',   # 256 MB of memory-mapped I/O
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Prepared statements kept per connection by the sqlite3 module.
+STATEMENT_CACHE_SIZE = 256
+
+# Open connections kept per thread; with one database per tenant (see
+# tenants.py) the least recently used are closed beyond this.
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '32'))
+
+# Connection class for new connections; metrics.py swaps in a timed one.
+connection_factory = sqlite3.Connection
+
+# Other database files attached to every new connection, by schema name
+# (e.g. the archive, see archive.py): a path, or a function of the main
+# database's path returning one (None skips it). Read-only connections
+# attach them read-only.
+attached = {}
+
+# Functions called with every new connection, e.g. to install a trace
+# callback for benchmarks or metrics.
+connection_hooks = []
+
+_local = threading.local()
+
+
+# ------------------- CONNECTIONS -------------------
+def open_connection(path=DB, readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=5,
+                               cached_statements=STATEMENT_CACHE_SIZE, factory=connection_factory)
+    else:
+        conn = sqlite3.connect(path, timeout=5, cached_statements=STATEMENT_CACHE_SIZE,
+                               factory=connection_factory)
+        conn.execute('PRAGMA journal_mode=WAL')
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    for name, attached_path in attached.items():
+        if callable(attached_path):
+            attached_path = attached_path(path)
+            if attached_path is None:
+                continue
+        conn.execute(f'ATTACH DATABASE ? AS {name}', (f'file:{attached_path}?mode=ro' if readonly else attached_path,))
+    for hook in connection_hooks:
+        hook(conn)
+    return conn
+
+
+def pooled_connection(path=DB, readonly=False):
+    """Return this thread's connection to `path`, opening it on first use.
+
+    Connections live as long as the thread, so their statement caches are
+    reused across requests. Each thread keeps at most POOL_SIZE of them and
+    closes the least recently used first.
+    """
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = OrderedDict()
+    key = (path, readonly)
+    conn = pool.get(key)
+    if conn is None:
+        conn = pool[key] = open_connection(path, readonly)
+        while len(pool) > POOL_SIZE:
+            _, evicted = pool.popitem(last=False)
+            evicted.close()
+    else:
+        pool.move_to_end(key)
+    return conn
+
+
+def close_thread_connections():
+    pool = getattr(_local, 'pool', {})
+    while pool:
+        _, conn = pool.popitem()
+        conn.close()
+
+
+# SQLite connections must not be used across fork(). A forked worker (e.g.
+# gunicorn --preload) starts with an empty pool; the inherited connections
+# are kept referenced but never used, so they are not closed from the child.
+_inherited = []
+
+
+def _reset_after_fork():
+    global _local
+    _inherited.append(_local)
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ------------------- FLASK INTEGRATION -------------------
+def current_path():
+    """Database file of the current request: the tenant's (see tenants.py) or the app's."""
+    return g.get('db_path') or current_app.config['DATABASE']
+
+
+def get_db(readonly=False):
+    """Connection for the current request, bound to flask.g.
+
+    Read-only connections are opened with mode=ro and are meant for GET
+    routes that never write.
+    """
+    key = 'db_ro' if readonly else 'db'
+    if key not in g:
+        setattr(g, key, pooled_connection(current_path(), readonly))
+    return getattr(g, key)
+
+
+def teardown_db(exc=None):
+    # Connections go back to the thread's pool; anything the request left
+    # uncommitted is rolled back so the next request starts clean.
+    for key in ('db', 'db_ro'):
+        conn = g.pop(key, None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', DB)
+    app.teardown_appcontext(teardown_db)
@@ -0,0 +1,171 @@
+"""Synthetic data generator for benchmarks and load tests.
+
+Fills a fresh database with customers, conversations, orders, reminders and
+tags. Output is reproducible for a given --seed.
+
+* messages per customer follow a Pareto distribution (most customers send
+  a few DMs, a few send hundreds), averaging --messages
+* --order-rate of customers place 1+ orders with log-normal prices
+* customers join over the last --days days; their messages and orders
+  follow their join date
+
+    python gen_data.py --scale 100k --db bench.db
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import db
+import tagging
+from init_db import init_db, rebuild_customer_stats
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BATCH_CUSTOMERS = 1000
+
+FIRST_NAMES = ('Ayesha', 'Bilal', 'Sara', 'Omar', 'Hina', 'Ali', 'Zara', 'Usman', 'Maya', 'Daniel',
+               'Fatima', 'Hamza', 'Noor', 'Ahmed', 'Emma', 'Liam', 'Sofia', 'Yusuf', 'Amna', 'Leo')
+LAST_NAMES = ('Khan', 'Malik', 'Ahmed', 'Shah', 'Butt', 'Smith', 'Garcia', 'Iqbal', 'Chaudhry', 'Brown')
+INBOUND_TEXTS = (
+    'Hi, what is the price of this?', 'Is this available in black?', 'How much for two?',
+    'Do you have it in stock?', 'I want to order one', 'Can I buy this with cash on delivery?',
+    'What sizes do you have?', 'Thanks!', 'When will my parcel arrive?', 'Can you share more pictures?',
+    'Is delivery free?', 'I would like to purchase the blue one', 'Hello', 'What is the cost of shipping?',
+)
+OUTBOUND_TEXTS = (
+    'Hi! Thanks for reaching out.', 'Yes, it is available.', 'The price is mentioned in the post.',
+    'Your order has been shipped.', 'Please share your address.', 'We deliver in 3-5 working days.',
+    'Sure, sending pictures now.', 'Let us know if you need anything else.',
+)
+PRODUCTS = ('Lawn Suit', 'Kurti', 'Handbag', 'Scarf', 'Sneakers', 'Watch', 'Perfume', 'Abaya', 'Earrings', 'Wallet')
+ORDER_STATUSES = (('Completed', 6), ('Shipped', 3), ('Pending', 2))
+STAGES = (('New', 5), ('Interested', 3), ('Hot Lead', 2))
+
+
+def _pick(rng, weighted):
+    return rng.choices([v for v, _ in weighted], [w for _, w in weighted])[0]
+
+
+def _ts(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(path, customers, messages=12, order_rate=0.3, reminder_rate=0.1, days=365, seed=1):
+    """Fill the database at `path` (created if needed) and return row counts."""
+    init_db(path)
+    rng = random.Random(seed)
+    conn = db.open_connection(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    matcher = tagging.get_matcher(conn)
+    start_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM customers').fetchone()[0] + 1
+    now = datetime.now().replace(microsecond=0)
+    counts = {'customers': 0, 'messages': 0, 'orders': 0, 'reminders': 0, 'tags': 0}
+
+    for batch_start in range(start_id, start_id + customers, BATCH_CUSTOMERS):
+        batch_ids = range(batch_start, min(batch_start + BATCH_CUSTOMERS, start_id + customers))
+        customer_rows, message_rows, order_rows, reminder_rows = [], [], [], []
+        for customer_id in batch_ids:
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            handle = f'{first.lower()}.{last.lower()}{customer_id}'
+            has_orders = rng.random() < order_rate
+            created = moment = now - timedelta(days=rng.uniform(0, days))
+            customer_rows.append((
+                customer_id, f'{first} {last}', handle,
+                f'{handle}@example.com' if rng.random() < 0.6 else None,
+                f'+92300{rng.randrange(10 ** 7):07d}' if rng.random() < 0.5 else None,
+                'Ordered' if has_orders else _pick(rng, STAGES), _ts(created),
+            ))
+
+            count = min(int(rng.paretovariate(1.5) * messages / 3), messages * 50)
+            for _ in range(max(count, 1)):
+                moment = min(moment + timedelta(minutes=rng.expovariate(1 / 240)), now)
+                inbound = rng.random() < 0.6
+                text = rng.choice(INBOUND_TEXTS if inbound else OUTBOUND_TEXTS)
+                message_rows.append((customer_id, text, 'inbound' if inbound else 'outbound', _ts(moment)))
+
+            if has_orders:
+                for _ in range(1 + int(rng.expovariate(1.0))):
+                    order_rows.append((
+                        customer_id, rng.choice(PRODUCTS), rng.randint(1, 3),
+                        round(math.exp(rng.gauss(3.6, 0.6)), 2), _pick(rng, ORDER_STATUSES),
+                        _ts(created + rng.random() * (now - created)),
+                    ))
+            if rng.random() < reminder_rate:
+                due = now + timedelta(days=rng.uniform(-30, 30))
+                status = 'Done' if due < now and rng.random() < 0.5 else 'Pending'
+                reminder_rows.append((customer_id, 'Follow up', _ts(due), status))
+
+        # Each batch's messages are indexed for search in one statement, and
+        # search indexing is paused only inside the batch transaction (see ingest.py)
+        conn.execute('INSERT INTO search_index_paused (paused) VALUES (1)')
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO customers (id, name, instagram_handle, email, phone, stage, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            customer_rows
+        )
+        conn.executemany(
+            'INSERT INTO messages (customer_id, message_text, direction, timestamp) VALUES (?, ?, ?, ?)',
+            message_rows
+        )
+        conn.execute(
+            'INSERT INTO messages_fts (rowid, message_text) SELECT id, message_text FROM messages WHERE id > ?',
+            (last_id,)
+        )
+        conn.execute('DELETE FROM search_index_paused')
+        conn.executemany(
+            'INSERT INTO orders (customer_id, product_name, quantity, price, status, timestamp) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            order_rows
+        )
+        conn.executemany(
+            'INSERT INTO reminders (customer_id, reminder_text, reminder_date, status) VALUES (?, ?, ?, ?)',
+            reminder_rows
+        )
+        counts['tags'] += tagging.tag_batch(
+            conn, [(r[0], r[1]) for r in message_rows if r[2] == 'inbound'], matcher
+        )
+        conn.commit()
+        counts['customers'] += len(customer_rows)
+        counts['messages'] += len(message_rows)
+        counts['orders'] += len(order_rows)
+        counts['reminders'] += len(reminder_rows)
+
+    rebuild_customer_stats(conn)
+    conn.execute('ANALYZE')
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--scale', choices=SCALES, default='1k')
+    size.add_argument('--customers', type=int)
+    parser.add_argument('--db', default=db.DB)
+    parser.add_argument('--messages', type=float, default=12, help='mean messages per customer')
+    parser.add_argument('--order-rate', type=float, default=0.3, help='share of customers with orders')
+    parser.add_argument('--reminder-rate', type=float, default=0.1)
+    parser.add_argument('--days', type=int, default=365, help='length of the generated history')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='replace an existing database file')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"{args.db} already exists; pass --force to replace it.")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    started = time.perf_counter()
+    counts = generate(args.db, args.customers or SCALES[args.scale], args.messages, args.order_rate,
+                      args.reminder_rate, args.days, args.seed)
+    print(', '.join(f'{v} {k}' for k, v in counts.items()) + f' in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+
+
+# ------------------- GROUP COMMIT -------------------
+class GroupCommitWriter:
+    """Single writer thread that commits queued writes in batches.
+
+    Request handlers submit write functions, called as fn(conn, *args),
+    instead of committing themselves. The writer runs up to `max_batch` of
+    them in one transaction, waiting at most `max_delay` seconds for a batch
+    to fill, so concurrent writers share one commit (and one fsync) instead
+    of queueing on SQLite's write lock. A caller's future resolves only once
+    the batch holding its write has committed. Each write runs in its own
+    savepoint, so one failing write does not undo the others.
+
+    The writer's connection uses synchronous=FULL by default: in WAL mode
+    NORMAL does not fsync on commit, so only FULL makes a resolved future
+    mean the write survives a power loss, at the cost of one fsync per batch.
+    """
+
+    def __init__(self, path=db.DB, max_batch=256, max_delay=0.002, synchronous='FULL'):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counters = {'writes': 0, 'failed': 0, 'batches': 0}
+
+    # Lifecycle
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Commit everything already submitted, then stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    # Producer side
+    def submit(self, fn, *args):
+        future = Future()
+        self.start()
+        self._queue.put((future, fn, args))
+        return future
+
+    def write(self, fn, *args):
+        """Submit a write and block until it is committed; returns fn's result."""
+        return self.submit(fn, *args).result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        stats['avg_batch'] = stats['writes'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    # Writer side
+    def _next_batch(self):
+        """Block for one write, then gather more until the batch is full or
+        max_delay has passed. Returns (batch, stopping)."""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, conn, batch):
+        committed = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for future, fn, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write')
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    conn.execute('RELEASE write')
+                    future.set_exception(e)
+                else:
+                    conn.execute('RELEASE write')
+                    committed.append((future, result))
+            conn.commit()
+        except sqlite3.Error as e:
+            # The whole transaction is lost; fail every write still pending
+            if conn.in_transaction:
+                conn.rollback()
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            with self._lock:
+                self.counters['failed'] += len(batch)
+            return
+        for future, result in committed:
+            future.set_result(result)
+        with self._lock:
+            self.counters['writes'] += len(committed)
+            self.counters['failed'] += len(batch) - len(committed)
+            self.counters['batches'] += 1
+
+    def _run(self):
+        conn = db.pooled_connection(self.path)
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._commit(conn, batch)
+        finally:
+            db.close_thread_connections()
@@ -0,0 +1,339 @@
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+import tagging
+from init_db import CATEGORY_SQL, STATS_UPSERT_SQL
+
+DB = 'crm.db'
+BATCH_SIZE = 20000
+MAX_REPORTED_ERRORS = 1000
+KINDS = ('customers', 'messages', 'orders')
+# Same format as CURRENT_TIMESTAMP (UTC), so imported rows sort, bucket and
+# page together with rows written by the app.
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Fields are validated in Python so a bad row is reported and skipped
+# without aborting the batch it is in.
+CUSTOMER_UPSERT_SQL = '''
+INSERT INTO customers (name, instagram_handle, email, phone, category, stage)
+VALUES (COALESCE(:name, :instagram_handle), :instagram_handle, :email, :phone,
+        COALESCE(:category, 'Lead'), COALESCE(:stage, 'New'))
+ON CONFLICT(instagram_handle) DO UPDATE SET
+    name = COALESCE(:name, customers.name),
+    email = COALESCE(excluded.email, customers.email),
+    phone = COALESCE(excluded.phone, customers.phone),
+    category = COALESCE(:category, customers.category),
+    stage = COALESCE(:stage, customers.stage)
+'''
+
+
+# ------------------- READING -------------------
+def read_records(stream, fmt='jsonl'):
+    """Yield (line_number, record) from a JSONL or CSV text stream.
+
+    Unparseable JSON lines are yielded as (line_number, ValueError).
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+
+def _text(record, *names):
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ''):
+            return str(value).strip()
+    return None
+
+
+def _handle(record):
+    handle = _text(record, 'instagram_handle', 'handle', 'username')
+    return handle.lstrip('@') if handle else None
+
+
+def _timestamp(record):
+    """UTC 'YYYY-MM-DD HH:MM:SS' from an ISO 8601 string or epoch seconds; None if absent.
+
+    ISO times without an offset are taken as UTC. ValueError if unparseable.
+    """
+    value = record.get('timestamp')
+    if value in (None, ''):
+        return None
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            parsed = datetime.fromtimestamp(value, timezone.utc)
+        else:
+            text = str(value).strip()
+            try:
+                parsed = datetime.fromtimestamp(float(text), timezone.utc)
+            except ValueError:
+                parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        return parsed.strftime(TIMESTAMP_FORMAT)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f'Invalid timestamp: {value!r}')
+
+
+def _add_delta(deltas, row, orders=0, messages=0, revenue=0):
+    """Accumulate a row into its customer's stats delta.
+
+    The delta's last activity is the newest row timestamp, or None (now)
+    once a row without one is seen.
+    """
+    delta = deltas.setdefault(row['customer_id'], [0, 0, 0, ''])
+    delta[0] += orders
+    delta[1] += messages
+    delta[2] += revenue
+    if row['timestamp'] is None:
+        delta[3] = None
+    elif delta[3] is not None:
+        delta[3] = max(delta[3], row['timestamp'])
+
+
+# ------------------- INGESTION -------------------
+class Ingester:
+    """Loads customers, messages or orders in large executemany transactions.
+
+    Messages and orders reference their customer by customer_id or by
+    instagram_handle; unknown handles create a customer on the fly. Stats,
+    tags and stages for each batch are updated in the same transaction.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.matcher = tagging.get_matcher(conn)
+        self.handle_ids = {}
+        self.known_ids = set()
+        self.inserted = 0
+        self.tags_added = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def run(self, kind, records):
+        parse = getattr(self, f'_parse_{kind}')
+        flush = getattr(self, f'_flush_{kind}')
+        batch = []
+        for line, record in records:
+            if isinstance(record, Exception):
+                self.error(line, f'Invalid JSON: {record}')
+                continue
+            if not isinstance(record, dict):
+                self.error(line, 'Record must be an object')
+                continue
+            try:
+                batch.append(parse(line, record))
+            except ValueError as e:
+                self.error(line, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self._commit(flush, batch)
+                batch = []
+        if batch:
+            self._commit(flush, batch)
+        return self.report()
+
+    def _commit(self, flush, batch):
+        try:
+            flush(batch)
+            self.conn.commit()
+        except sqlite3.DatabaseError:
+            self.conn.rollback()
+            raise
+
+    def report(self):
+        return {'inserted': self.inserted, 'tags_added': self.tags_added,
+                'error_count': self.error_count, 'errors': sorted(self.errors, key=lambda e: e['line'])}
+
+    # Customers
+    def _parse_customers(self, line, record):
+        handle = _handle(record)
+        if not handle:
+            raise ValueError('instagram_handle is required')
+        return {
+            'name': _text(record, 'name'),
+            'instagram_handle': handle,
+            'email': _text(record, 'email'),
+            'phone': _text(record, 'phone'),
+            'category': _text(record, 'category'),
+            'stage': _text(record, 'stage'),
+        }
+
+    def _flush_customers(self, batch):
+        self.conn.executemany(CUSTOMER_UPSERT_SQL, batch)
+        self.inserted += len(batch)
+
+    # Messages and orders share customer resolution
+    def _parse_customer_ref(self, record):
+        customer_id = record.get('customer_id')
+        if customer_id not in (None, ''):
+            try:
+                return int(customer_id), None
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid customer_id: {customer_id!r}')
+        handle = _handle(record)
+        if not handle:
+            raise ValueError('customer_id or instagram_handle is required')
+        return None, handle
+
+    def _resolve_customers(self, batch):
+        """Fill in row['customer_id'] for every row; returns rows that resolved."""
+        handles = list({row['handle'] for row in batch if row['customer_id'] is None} - self.handle_ids.keys())
+        if handles:
+            self.conn.executemany(
+                'INSERT INTO customers (name, instagram_handle) VALUES (?, ?) ON CONFLICT(instagram_handle) DO NOTHING',
+                [(h, h) for h in handles]
+            )
+            for i in range(0, len(handles), 500):
+                chunk = handles[i:i + 500]
+                for customer_id, handle in self.conn.execute(
+                    f'SELECT id, instagram_handle FROM customers WHERE instagram_handle IN ({",".join("?" * len(chunk))})',
+                    chunk
+                ):
+                    self.handle_ids[handle] = customer_id
+                    self.known_ids.add(customer_id)
+        ids = list({row['customer_id'] for row in batch if row['customer_id'] is not None} - self.known_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.known_ids.update(r[0] for r in self.conn.execute(
+                f'SELECT id FROM customers WHERE id IN ({",".join("?" * len(chunk))})', chunk
+            ))
+        resolved = []
+        for row in batch:
+            if row['customer_id'] is None:
+                row['customer_id'] = self.handle_ids[row['handle']]
+            if row['customer_id'] in self.known_ids:
+                resolved.append(row)
+            else:
+                self.error(row['line'], f"Unknown customer_id: {row['customer_id']}")
+        return resolved
+
+    def _update_stats(self, deltas):
+        self.conn.executemany(
+            STATS_UPSERT_SQL,
+            [(customer_id, *delta) for customer_id, delta in deltas.items()]
+        )
+        self.conn.executemany(
+            f'UPDATE customer_stats SET category = {CATEGORY_SQL} WHERE customer_id=?',
+            [(customer_id,) for customer_id in deltas]
+        )
+
+    # Messages
+    def _parse_messages(self, line, record):
+        customer_id, handle = self._parse_customer_ref(record)
+        text = _text(record, 'message_text', 'message', 'text')
+        if text is None:
+            raise ValueError('message_text is required')
+        direction = _text(record, 'direction') or 'inbound'
+        return {'line': line, 'customer_id': customer_id, 'handle': handle, 'message_text': text,
+                'direction': direction, 'timestamp': _timestamp(record)}
+
+    def _flush_messages(self, batch):
+        rows = self._resolve_customers(batch)
+        # Index the batch for search in one statement rather than per row.
+        # The first write takes the write lock, so no other connection can
+        # add messages between reading last_id and the inserts below.
+        self.conn.execute('INSERT INTO search_index_paused (paused) VALUES (1)')
+        last_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+        self.conn.executemany(
+            'INSERT INTO messages (customer_id, message_text, direction, timestamp) '
+            'VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+            [(r['customer_id'], r['message_text'], r['direction'], r['timestamp']) for r in rows]
+        )
+        self.conn.execute(
+            'INSERT INTO messages_fts (rowid, message_text) SELECT id, message_text FROM messages WHERE id > ?',
+            (last_id,)
+        )
+        self.conn.execute('DELETE FROM search_index_paused')
+        deltas = {}
+        for r in rows:
+            _add_delta(deltas, r, messages=1)
+        self._update_stats(deltas)
+        self.tags_added += tagging.tag_batch(
+            self.conn, [(r['customer_id'], r['message_text']) for r in rows], self.matcher
+        )
+        self.inserted += len(rows)
+
+    # Orders
+    def _parse_orders(self, line, record):
+        customer_id, handle = self._parse_customer_ref(record)
+        product_name = _text(record, 'product_name', 'product')
+        if product_name is None:
+            raise ValueError('product_name is required')
+        try:
+            quantity = int(record.get('quantity') or 1)
+            price = float(record['price'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('price is required and quantity/price must be numbers')
+        return {'line': line, 'customer_id': customer_id, 'handle': handle, 'product_name': product_name,
+                'quantity': quantity, 'price': price, 'status': _text(record, 'status') or 'Pending',
+                'timestamp': _timestamp(record)}
+
+    def _flush_orders(self, batch):
+        rows = self._resolve_customers(batch)
+        self.conn.executemany(
+            'INSERT INTO orders (customer_id, product_name, quantity, price, status, timestamp) '
+            'VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+            [(r['customer_id'], r['product_name'], r['quantity'], r['price'], r['status'], r['timestamp'])
+             for r in rows]
+        )
+        deltas = {}
+        for r in rows:
+            _add_delta(deltas, r, orders=1, revenue=r['price'])
+        self.conn.executemany("UPDATE customers SET stage='Ordered' WHERE id=?", [(c,) for c in deltas])
+        self._update_stats(deltas)
+        self.inserted += len(rows)
+
+
+def ingest(conn, kind, records, batch_size=BATCH_SIZE):
+    """Load `records` (from read_records) of the given kind; returns a report dict."""
+    if kind not in KINDS:
+        raise ValueError(f'Unknown kind: {kind}')
+    return Ingester(conn, batch_size).run(kind, records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-load customers, messages or orders from JSONL or CSV.')
+    parser.add_argument('kind', choices=KINDS)
+    parser.add_argument('file', help="path to a .jsonl or .csv file, or '-' for stdin")
+    parser.add_argument('--db', default=DB)
+    parser.add_argument('--format', choices=['jsonl', 'csv'])
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.file.endswith('.csv') else 'jsonl')
+    conn = sqlite3.connect(args.db)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    stream = sys.stdin if args.file == '-' else open(args.file, newline='', encoding='utf-8')
+    start = time.perf_counter()
+    with stream:
+        report = ingest(conn, args.kind, read_records(stream, fmt), args.batch_size)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    for e in report['errors']:
+        print(f"line {e['line']}: {e['error']}", file=sys.stderr)
+    rate = report['inserted'] / elapsed if elapsed else 0
+    print(f"Inserted {report['inserted']} {args.kind} ({rate:.0f} rows/s), "
+          f"{report['tags_added']} tags added, {report['error_count']} errors.")
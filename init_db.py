@@ -1,132 +1,792 @@
+import argparse
+import os
+import re
 import sqlite3
+import sys
 
-# Connect to database (creates if not exists)
-conn = sqlite3.connect('crm.db')
-c = conn.cursor()
+DB = 'crm.db'
 
-# -------------------------
-# Customers table
-# -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS customers (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    instagram_handle TEXT NOT NULL UNIQUE,
-    email TEXT,
-    phone TEXT,
-    category TEXT DEFAULT 'Lead',
-    stage TEXT DEFAULT 'New'  -- Lead Pipeline Stage
-)
-''')
+# Lead scoring: score = orders*2 + messages. Thresholds can be tuned through
+# the environment; run `python init_db.py rebuild-stats` after changing them.
+LEAD_SCORE_VIP = int(os.getenv('LEAD_SCORE_VIP', '10'))
+LEAD_SCORE_ACTIVE = int(os.getenv('LEAD_SCORE_ACTIVE', '5'))
+
+CATEGORY_SQL = f'''
+CASE
+    WHEN orders_count*2 + messages_count >= {LEAD_SCORE_VIP} THEN 'VIP'
+    WHEN orders_count*2 + messages_count >= {LEAD_SCORE_ACTIVE} THEN 'Active'
+    ELSE 'Lead'
+END
+'''
+
+# Adds (orders, messages, revenue) deltas to a customer's stats row; follow
+# with an UPDATE using CATEGORY_SQL to recompute the category.
+# Parameters: customer_id, orders, messages, revenue and the time of the
+# activity (None for now). last_activity never moves back, so backfilled
+# history does not make a customer look recently active.
+STATS_UPSERT_SQL = '''
+INSERT INTO customer_stats (customer_id, orders_count, messages_count, total_revenue, last_activity)
+VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+ON CONFLICT(customer_id) DO UPDATE SET
+    orders_count = orders_count + excluded.orders_count,
+    messages_count = messages_count + excluded.messages_count,
+    total_revenue = total_revenue + excluded.total_revenue,
+    last_activity = CASE WHEN last_activity IS NULL OR excluded.last_activity > last_activity
+                         THEN excluded.last_activity ELSE last_activity END
+'''
+
+
+def create_tables(conn):
+    c = conn.cursor()
+
+    # -------------------------
+    # Customers table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        instagram_handle TEXT NOT NULL UNIQUE,
+        email TEXT,
+        phone TEXT,
+        category TEXT DEFAULT 'Lead',
+        stage TEXT DEFAULT 'New'  -- Lead Pipeline Stage
+    )
+    ''')
+
+    # -------------------------
+    # Messages table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        message_text TEXT,
+        direction TEXT,  -- inbound or outbound
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # -------------------------
+    # Orders table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        product_name TEXT,
+        quantity INTEGER,
+        price REAL,  -- Revenue Tracking
+        status TEXT DEFAULT 'Pending',  -- Pending, Completed, Shipped
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # -------------------------
+    # AI Summaries table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ai_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        summary_text TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+        
+    ''')
+
+    # -------------------------
+    # Message Templates table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS message_templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        content TEXT NOT NULL
+    )
+    ''')
+
+    # -------------------------
+    # Customer Tags table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS customer_tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        tag TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # -------------------------
+    # Reminders table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        reminder_text TEXT,
+        reminder_date DATETIME,
+        status TEXT DEFAULT 'Pending',
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # -------------------------
+    # Activity Timeline table
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS activity_timeline (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        action TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # Create ai_replies table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ai_replies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        reply TEXT NOT NULL,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (customer_id) REFERENCES customers(id)
+    )
+    ''')
+
+    # -------------------------
+    # Customer Stats table (denormalized, maintained by app.py writes)
+    # -------------------------
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS customer_stats (
+        customer_id INTEGER PRIMARY KEY,
+        orders_count INTEGER NOT NULL DEFAULT 0,
+        messages_count INTEGER NOT NULL DEFAULT 0,
+        total_revenue REAL NOT NULL DEFAULT 0,
+        last_activity DATETIME,
+        category TEXT NOT NULL DEFAULT 'Lead',
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    ''')
 
-# -------------------------
-# Messages table
-# -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS messages (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    message_text TEXT,
-    direction TEXT,  -- inbound or outbound
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
-)
-''')
 
 # -------------------------
-# Orders table
+# Customer Stats backfill
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS orders (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    product_name TEXT,
-    quantity INTEGER,
-    price REAL,  -- Revenue Tracking
-    status TEXT DEFAULT 'Pending',  -- Pending, Completed, Shipped
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
-)
-''')
+# Tables whose old rows may have been moved to the archive database
+# (see archive.py), attached to connections as schema "archive".
+ARCHIVED_TABLES = ('messages', 'activity_timeline')
+
+
+def history(conn, table):
+    """FROM source for all rows of `table`, including archived ones when the archive is attached."""
+    if table in ARCHIVED_TABLES and any(r[1] == 'archive' for r in conn.execute('PRAGMA database_list')):
+        # Rows caught between copy and delete by an interrupted archive run are counted once
+        return (f'(SELECT * FROM main.{table} UNION ALL '
+                f'SELECT * FROM archive.{table} WHERE id NOT IN (SELECT id FROM main.{table}))')
+    return table
+
+
+def rebuild_customer_stats(conn):
+    conn.execute('DELETE FROM customer_stats')
+    conn.execute('''
+    INSERT INTO customer_stats (customer_id, orders_count, messages_count, total_revenue, last_activity)
+    SELECT c.id,
+           COALESCE(o.orders_count, 0),
+           COALESCE(m.messages_count, 0),
+           COALESCE(o.revenue, 0),
+           MAX(COALESCE(o.last_order, ''), COALESCE(m.last_message, ''))
+    FROM customers c
+    LEFT JOIN (
+        SELECT customer_id, COUNT(*) AS orders_count, SUM(price) AS revenue, MAX(timestamp) AS last_order
+        FROM orders GROUP BY customer_id
+    ) o ON o.customer_id = c.id
+    LEFT JOIN (
+        SELECT customer_id, COUNT(*) AS messages_count, MAX(timestamp) AS last_message
+        FROM {messages} GROUP BY customer_id
+    ) m ON m.customer_id = c.id
+    '''.format(messages=history(conn, 'messages')))
+    conn.execute("UPDATE customer_stats SET last_activity=NULL WHERE last_activity=''")
+    conn.execute(f'UPDATE customer_stats SET category = {CATEGORY_SQL}')
+    conn.commit()
+
 
 # -------------------------
-# AI Summaries table
+# Customer-owned rows
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS ai_summaries (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    summary_text TEXT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
+# Every table with a customer_id referencing customers(id). Since migration 8
+# these references are ON DELETE CASCADE, enforced by PRAGMA foreign_keys=ON
+# on every app connection (see db.py).
+CUSTOMER_TABLES = (
+    'messages', 'orders', 'ai_summaries', 'customer_tags', 'reminders',
+    'activity_timeline', 'ai_replies', 'customer_stats',
 )
-        
-''')
+
+
+def delete_orphans(conn):
+    """Delete rows whose customer no longer exists. Returns {table: rows deleted}."""
+    return {
+        table: conn.execute(
+            f'DELETE FROM {table} WHERE customer_id NOT IN (SELECT id FROM customers)'
+        ).rowcount
+        for table in CUSTOMER_TABLES
+    }
+
+
+def cascade_customer_deletes(conn):
+    """Rebuild each customer-owned table with ON DELETE CASCADE on customer_id.
+
+    SQLite cannot alter a foreign key in place, so each table is recreated
+    from its own schema, copied, dropped and renamed back; its indexes,
+    triggers and AUTOINCREMENT counter are restored afterwards.
+    """
+    delete_orphans(conn)
+    for table in CUSTOMER_TABLES:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+        if 'ON DELETE CASCADE' in sql:
+            continue
+        dependents = [r[0] for r in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (table,)
+        )]
+        seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,)).fetchone()
+        new_sql = re.sub(r'(REFERENCES\s+customers\s*\(\s*id\s*\))', r'\1 ON DELETE CASCADE', sql, flags=re.IGNORECASE)
+        new_sql = re.sub(rf'^CREATE TABLE\s+(IF NOT EXISTS\s+)?{table}\b', f'CREATE TABLE {table}_new', new_sql)
+        conn.execute(new_sql)
+        conn.execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+        if seq:
+            conn.execute('UPDATE sqlite_sequence SET seq=MAX(seq, ?) WHERE name=?', (seq[0], table))
+        for dependent in dependents:
+            conn.execute(dependent)
+    violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise sqlite3.IntegrityError(f'foreign key violations after migration: {violations[:5]}')
+
+
+def compact(conn):
+    """Delete orphaned rows and reclaim free pages. Returns (orphans, bytes freed).
+
+    The first run switches the database to auto_vacuum=INCREMENTAL with a
+    full VACUUM; later runs only need PRAGMA incremental_vacuum.
+    """
+    orphans = delete_orphans(conn)
+    conn.commit()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    before = conn.execute('PRAGMA page_count').fetchone()[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        conn.execute('PRAGMA incremental_vacuum')
+    after = conn.execute('PRAGMA page_count').fetchone()[0]
+    return orphans, (before - after) * page_size
+
 
 # -------------------------
-# Message Templates table
+# Analytics rollups
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS message_templates (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    content TEXT NOT NULL
-)
-''')
+# Daily and monthly sums per (metric, dimension), maintained by triggers on
+# orders, messages and customers so that every write path (routes, bulk
+# ingestion, cascade deletes, merges) keeps them current. rollup_totals
+# holds counts of current state that are not bucketed by time.
+ROLLUP_DAY = "COALESCE(date({ts}), 'unknown')"
+ROLLUP_MONTH = "COALESCE(strftime('%Y-%m', {ts}), 'unknown')"
+
+# (table, metric, timestamp, dimension, value); {row} is new, old or the table alias
+ROLLUP_METRICS = [
+    ('orders', 'orders', '{row}.timestamp', "COALESCE({row}.status, '')", '1'),
+    ('orders', 'revenue', '{row}.timestamp', "COALESCE({row}.status, '')", 'COALESCE({row}.price, 0)'),
+    ('messages', 'messages', '{row}.timestamp', "COALESCE({row}.direction, '')", '1'),
+    ('customers', 'new_customers', 'COALESCE({row}.created_at, CURRENT_TIMESTAMP)', "''", '1'),
+]
+# Columns whose update moves a row between buckets
+ROLLUP_WATCHED = {'orders': ('price', 'status', 'timestamp'), 'messages': ('direction', 'timestamp')}
+
+
+def _rollup_upserts(table, row, sign):
+    statements = []
+    for source, metric, ts, dimension, value in ROLLUP_METRICS:
+        if source != table:
+            continue
+        ts, dimension, value = (part.format(row=row) for part in (ts, dimension, value))
+        for rollup, bucket in (('daily_rollups', ROLLUP_DAY), ('monthly_rollups', ROLLUP_MONTH)):
+            statements.append(
+                f"INSERT INTO {rollup} VALUES ('{metric}', {bucket.format(ts=ts)}, {dimension}, {sign}{value}) "
+                'ON CONFLICT DO UPDATE SET value = value + excluded.value;'
+            )
+    return '\n        '.join(statements)
+
+
+def _stage_upsert(row, sign):
+    return (f"INSERT INTO rollup_totals VALUES ('customers', COALESCE({row}.stage, ''), {sign}1) "
+            'ON CONFLICT DO UPDATE SET value = value + excluded.value;')
+
+
+def create_rollups(conn):
+    """Rollup tables and their maintenance triggers, backfilled from existing data."""
+    conn.execute('ALTER TABLE customers ADD COLUMN created_at DATETIME')
+    # Best guess for existing customers: their first recorded activity
+    conn.execute('''
+    UPDATE customers SET created_at = COALESCE((
+        SELECT MIN(ts) FROM (
+            SELECT MIN(timestamp) AS ts FROM messages WHERE customer_id = customers.id
+            UNION ALL SELECT MIN(timestamp) FROM orders WHERE customer_id = customers.id
+            UNION ALL SELECT MIN(timestamp) FROM activity_timeline WHERE customer_id = customers.id
+        )
+    ), CURRENT_TIMESTAMP)
+    ''')
+    for rollup, bucket in (('daily_rollups', 'day'), ('monthly_rollups', 'month')):
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {rollup} (
+            metric TEXT NOT NULL,
+            {bucket} TEXT NOT NULL,
+            dimension TEXT NOT NULL DEFAULT '',
+            value NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, {bucket}, dimension)
+        ) WITHOUT ROWID
+        ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rollup_totals (
+        metric TEXT NOT NULL,
+        dimension TEXT NOT NULL DEFAULT '',
+        value NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY (metric, dimension)
+    ) WITHOUT ROWID
+    ''')
+
+    triggers = {
+        'customers_created_at': 'AFTER INSERT ON customers WHEN new.created_at IS NULL BEGIN\n'
+                                '        UPDATE customers SET created_at = CURRENT_TIMESTAMP WHERE id = new.id;',
+        'customers_rollup_ai': f"AFTER INSERT ON customers BEGIN\n        {_rollup_upserts('customers', 'new', '')}"
+                               f"\n        {_stage_upsert('new', '')}",
+        'customers_rollup_ad': f"AFTER DELETE ON customers BEGIN\n        {_rollup_upserts('customers', 'old', '-')}"
+                               f"\n        {_stage_upsert('old', '-')}",
+        'customers_rollup_au': 'AFTER UPDATE OF stage ON customers WHEN old.stage IS NOT new.stage BEGIN\n'
+                               f"        {_stage_upsert('old', '-')}\n        {_stage_upsert('new', '')}",
+    }
+    for table, watched in ROLLUP_WATCHED.items():
+        changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in watched)
+        triggers[f'{table}_rollup_ai'] = f"AFTER INSERT ON {table} BEGIN\n        {_rollup_upserts(table, 'new', '')}"
+        triggers[f'{table}_rollup_ad'] = f"AFTER DELETE ON {table} BEGIN\n        {_rollup_upserts(table, 'old', '-')}"
+        triggers[f'{table}_rollup_au'] = (
+            f"AFTER UPDATE OF {', '.join(watched)} ON {table} WHEN {changed} BEGIN\n"
+            f"        {_rollup_upserts(table, 'old', '-')}\n        {_rollup_upserts(table, 'new', '')}"
+        )
+    for name, body in triggers.items():
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(f'CREATE TRIGGER {name} {body}\n    END')
+    rebuild_rollups(conn)
+
+
+def add_to_rollups(conn, table, source, where='1', params=(), sign=''):
+    """Add (or with sign='-' subtract) the rows of `source` matching `where` to the rollups.
+
+    `source` is a FROM source holding rows of `table`, e.g. archive.messages,
+    whose changes no trigger sees. Runs in the caller's transaction.
+    """
+    for source_table, metric, ts, dimension, value in ROLLUP_METRICS:
+        if source_table != table:
+            continue
+        ts, dimension, value = (part.format(row='r') for part in (ts, dimension, value))
+        for rollup, bucket in (('daily_rollups', ROLLUP_DAY), ('monthly_rollups', ROLLUP_MONTH)):
+            conn.execute(
+                f"INSERT INTO {rollup} SELECT '{metric}', {bucket.format(ts=ts)}, {dimension}, {sign}SUM({value}) "
+                f'FROM {source} r WHERE {where} GROUP BY 2, 3 '
+                'ON CONFLICT DO UPDATE SET value = value + excluded.value',
+                params
+            )
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from the base tables (in the caller's transaction)."""
+    for rollup in ('daily_rollups', 'monthly_rollups', 'rollup_totals'):
+        conn.execute(f'DELETE FROM {rollup}')
+    for table in dict.fromkeys(m[0] for m in ROLLUP_METRICS):
+        add_to_rollups(conn, table, history(conn, table))
+    conn.execute("INSERT INTO rollup_totals SELECT 'customers', COALESCE(stage, ''), COUNT(*) FROM customers GROUP BY 2")
+
 
 # -------------------------
-# Customer Tags table
+# Page versions
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS customer_tags (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    tag TEXT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
-)
-''')
+# One counter per customer, bumped whenever anything shown on that
+# customer's pages changes, and row 0 for the dashboard. page_cache.py
+# turns them into ETags, so cached pages go stale on writes from any path.
+PAGE_DASHBOARD_TABLES = ('customers', 'messages', 'orders', 'customer_stats')
+
+
+def _version_bump(customer_id, where=None):
+    where = f'{customer_id} IS NOT NULL' + (f' AND {where}' if where else '')
+    return (f"INSERT INTO page_versions SELECT {customer_id}, 1, CURRENT_TIMESTAMP WHERE {where} "
+            'ON CONFLICT DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;')
+
+
+def create_page_versions(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS page_versions (
+        customer_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    )
+    ''')
+    for table in ('customers', *CUSTOMER_TABLES):
+        key = 'id' if table == 'customers' else 'customer_id'
+        dashboard = _version_bump(0) if table in PAGE_DASHBOARD_TABLES else ''
+        bodies = {
+            'ai': f'AFTER INSERT ON {table} BEGIN\n        {_version_bump(f"new.{key}")}',
+            'ad': f'AFTER DELETE ON {table} BEGIN\n        {_version_bump(f"old.{key}")}',
+            # Merges move rows between customers, so both pages change
+            'au': f'AFTER UPDATE ON {table} BEGIN\n        {_version_bump(f"new.{key}")}\n'
+                  f'        {_version_bump(f"old.{key}", f"old.{key} IS NOT new.{key}")}',
+        }
+        for suffix, body in bodies.items():
+            name = f'{table}_page_version_{suffix}'
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute(f'CREATE TRIGGER {name} {body}\n        {dashboard}\n    END')
+
+
+# Delete triggers of tables the archiver moves rows out of only fire for real deletions
+ARCHIVE_NOT_RUNNING = 'WHEN NOT EXISTS (SELECT 1 FROM archive_running)'
+
+
+def pause_history_triggers(conn):
+    """Rows moved to the archive are not deletions: skip rollup and page-version
+    updates while archive_running has a row (only ever inside the archiver's
+    own transaction)."""
+    conn.execute('CREATE TABLE IF NOT EXISTS archive_running (running INTEGER)')
+    when = ARCHIVE_NOT_RUNNING
+    triggers = {
+        'messages_rollup_ad': ('messages', _rollup_upserts('messages', 'old', '-')),
+        'messages_page_version_ad': ('messages', f"{_version_bump('old.customer_id')}\n        {_version_bump(0)}"),
+        'activity_timeline_page_version_ad': ('activity_timeline', _version_bump('old.customer_id')),
+    }
+    for name, (table, body) in triggers.items():
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(f'CREATE TRIGGER {name} AFTER DELETE ON {table} {when} BEGIN\n        {body}\n    END')
+
+
+def drop_deleted_page_versions(conn):
+    """Deleted customers keep no page_versions row.
+
+    Child rows deleted after their customer (cascades, merges) no longer
+    bump, and so re-create, the customer's row, and deleting a customer
+    removes it. Customer ids are AUTOINCREMENT, so a version never restarts
+    for a reused id.
+    """
+    for table in CUSTOMER_TABLES:
+        name = f'{table}_page_version_ad'
+        when = ARCHIVE_NOT_RUNNING if table in ARCHIVED_TABLES else ''
+        body = _version_bump('old.customer_id', 'EXISTS (SELECT 1 FROM customers WHERE id = old.customer_id)')
+        if table in PAGE_DASHBOARD_TABLES:
+            body += f'\n        {_version_bump(0)}'
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(f'CREATE TRIGGER {name} AFTER DELETE ON {table} {when} BEGIN\n        {body}\n    END')
+    conn.execute('DROP TRIGGER IF EXISTS customers_page_version_ad')
+    conn.execute(f'''CREATE TRIGGER customers_page_version_ad AFTER DELETE ON customers BEGIN
+        DELETE FROM page_versions WHERE customer_id = old.id;
+        {_version_bump(0)}
+    END''')
+    conn.execute('DELETE FROM page_versions WHERE customer_id != 0 AND customer_id NOT IN (SELECT id FROM customers)')
+
 
 # -------------------------
-# Reminders table
+# Migrations
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS reminders (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    reminder_text TEXT,
-    reminder_date DATETIME,
-    status TEXT DEFAULT 'Pending',
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
-)
-''')
+# Schema changes after the base tables are numbered steps applied in order.
+# The number of the last applied step is stored in PRAGMA user_version, so
+# running init_db.py again on an existing crm.db only applies new steps.
+# A step is either an SQL script or a function taking the connection.
+MIGRATIONS = [
+    # 1: indexes for every per-customer lookup in app.py
+    '''
+    CREATE INDEX IF NOT EXISTS idx_messages_customer_ts ON messages(customer_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_orders_customer_ts ON orders(customer_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_activity_customer_ts ON activity_timeline(customer_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_ai_summaries_customer_ts ON ai_summaries(customer_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_ai_replies_customer_message ON ai_replies(customer_id, message);
+    CREATE INDEX IF NOT EXISTS idx_customer_tags_customer ON customer_tags(customer_id, tag);
+    CREATE INDEX IF NOT EXISTS idx_reminders_customer ON reminders(customer_id, reminder_date);
+    CREATE INDEX IF NOT EXISTS idx_reminders_date ON reminders(reminder_date);
+    ''',
+    # 2: full-text search over customers and message history, kept in sync by triggers
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+        name, instagram_handle, email, phone,
+        content='customers', content_rowid='id', prefix='2 3'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        message_text,
+        content='messages', content_rowid='id', prefix='2 3'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS customers_fts_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO customers_fts(rowid, name, instagram_handle, email, phone)
+        VALUES (new.id, new.name, new.instagram_handle, new.email, new.phone);
+    END;
+    CREATE TRIGGER IF NOT EXISTS customers_fts_ad AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, name, instagram_handle, email, phone)
+        VALUES ('delete', old.id, old.name, old.instagram_handle, old.email, old.phone);
+    END;
+    CREATE TRIGGER IF NOT EXISTS customers_fts_au AFTER UPDATE OF name, instagram_handle, email, phone ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, name, instagram_handle, email, phone)
+        VALUES ('delete', old.id, old.name, old.instagram_handle, old.email, old.phone);
+        INSERT INTO customers_fts(rowid, name, instagram_handle, email, phone)
+        VALUES (new.id, new.name, new.instagram_handle, new.email, new.phone);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, message_text) VALUES (new.id, new.message_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF message_text ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+        INSERT INTO messages_fts(rowid, message_text) VALUES (new.id, new.message_text);
+    END;
+
+    INSERT INTO customers_fts(customers_fts) VALUES ('rebuild');
+    INSERT INTO messages_fts(messages_fts) VALUES ('rebuild');
+    ''',
+    # 3: auto-tagging rules in the database, one tag per customer at most
+    '''
+    CREATE TABLE IF NOT EXISTS tag_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag TEXT NOT NULL,
+        keyword TEXT NOT NULL,
+        UNIQUE(tag, keyword)
+    );
+    INSERT OR IGNORE INTO tag_rules (tag, keyword) VALUES
+        ('Interested', 'price'), ('Interested', 'cost'), ('Interested', 'how much'),
+        ('Hot Lead', 'available'), ('Hot Lead', 'stock'), ('Hot Lead', 'in stock'),
+        ('Ready to Order', 'order'), ('Ready to Order', 'buy'), ('Ready to Order', 'purchase');
+
+    DELETE FROM customer_tags
+    WHERE id NOT IN (SELECT MIN(id) FROM customer_tags GROUP BY customer_id, tag);
+    DROP INDEX IF EXISTS idx_customer_tags_customer;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_customer_tags_unique ON customer_tags(customer_id, tag);
+    ''',
+    # 4: shared AI reply cache keyed by hash(model, tone, normalized message)
+    '''
+    CREATE TABLE IF NOT EXISTS ai_reply_cache (
+        cache_key TEXT PRIMARY KEY,
+        reply TEXT NOT NULL,
+        created_at REAL NOT NULL  -- unix time, for TTL expiry
+    );
+    CREATE INDEX IF NOT EXISTS idx_ai_reply_cache_created ON ai_reply_cache(created_at);
+    ''',
+    # 5: summaries remember the last message they cover, for incremental updates
+    '''
+    ALTER TABLE ai_summaries ADD COLUMN last_message_id INTEGER NOT NULL DEFAULT 0;
+    ''',
+    # 6: persistent queue for background AI jobs
+    '''
+    CREATE TABLE IF NOT EXISTS ai_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,  -- reply, summary
+        payload TEXT NOT NULL,  -- JSON
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+        result TEXT,  -- JSON
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL DEFAULT 0,  -- unix time, for retry backoff
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_ai_jobs_status ON ai_jobs(status, run_after);
+    ''',
+    # 7: let bulk loads pause per-row message indexing and index each batch in
+    # one statement instead. Rows in search_index_paused only ever exist
+    # inside the loading transaction, so other writers are unaffected.
+    '''
+    CREATE TABLE IF NOT EXISTS search_index_paused (paused INTEGER);
+    DROP TRIGGER IF EXISTS messages_fts_ai;
+    CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages
+    WHEN NOT EXISTS (SELECT 1 FROM search_index_paused)
+    BEGIN
+        INSERT INTO messages_fts(rowid, message_text) VALUES (new.id, new.message_text);
+    END;
+    ''',
+    # 8: deleting a customer deletes everything that belongs to them
+    cascade_customer_deletes,
+    # 9: reminder dates as sortable 'YYYY-MM-DD HH:MM:SS' local time, and an
+    # index for finding pending reminders by due date across all customers
+    '''
+    UPDATE reminders SET reminder_date = COALESCE(datetime(reminder_date), reminder_date)
+    WHERE reminder_date IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_reminders_status_date ON reminders(status, reminder_date);
+    ''',
+    # 10: day/month rollups for dashboard analytics, and customers.created_at
+    create_rollups,
+    # 11: per-customer page versions for ETags and the page cache
+    create_page_versions,
+    # 12: let the archiver move old messages and activity without touching rollups
+    pause_history_triggers,
+    # 13: no page versions for deleted customers
+    drop_deleted_page_versions,
+    # 14: workers claim the oldest queued job; keep the index in id order so
+    # the claim does not sort every queued job
+    '''
+    DROP INDEX IF EXISTS idx_ai_jobs_status;
+    CREATE INDEX IF NOT EXISTS idx_ai_jobs_status ON ai_jobs(status, id, run_after);
+    ''',
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations, each in its own transaction. Returns the new version."""
+    version = schema_version(conn)
+    conn.commit()
+    # Table rebuilds must not trigger cascades; this pragma is a no-op inside a transaction
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys=OFF')
+    try:
+        version = _apply_migrations(conn, version)
+    finally:
+        conn.execute(f'PRAGMA foreign_keys={foreign_keys}')
+    return version
+
+
+def _apply_migrations(conn, version):
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.commit()
+        try:
+            if callable(step):
+                conn.execute('BEGIN')
+                step(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.commit()
+            else:
+                conn.executescript(f'BEGIN;\n{step}\nPRAGMA user_version = {number};\nCOMMIT;')
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        version = number
+    return version
+
 
 # -------------------------
-# Activity Timeline table
+# Query plan checks
 # -------------------------
-c.execute('''
-CREATE TABLE IF NOT EXISTS activity_timeline (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER,
-    action TEXT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(customer_id) REFERENCES customers(id)
-)
-''')
-# Create ai_replies table
-c.execute('''
-CREATE TABLE IF NOT EXISTS ai_replies (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    customer_id INTEGER NOT NULL,
-    message TEXT NOT NULL,
-    reply TEXT NOT NULL,
-    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (customer_id) REFERENCES customers(id)
-)
-''')
+# Hot queries from app.py and the index each one must use. Run
+# `python init_db.py check-plans` after schema changes to catch regressions.
+HOT_QUERIES = [
+    ('SELECT * FROM messages WHERE customer_id=? ORDER BY timestamp DESC, id DESC LIMIT ?', 'idx_messages_customer_ts'),
+    ('SELECT * FROM messages WHERE customer_id=? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?',
+     'idx_messages_customer_ts'),
+    ('SELECT * FROM orders WHERE customer_id=? ORDER BY timestamp DESC, id DESC LIMIT ?', 'idx_orders_customer_ts'),
+    ('SELECT * FROM activity_timeline WHERE customer_id=? ORDER BY timestamp DESC, id DESC LIMIT ?',
+     'idx_activity_customer_ts'),
+    ('SELECT summary_text FROM ai_summaries WHERE customer_id=? ORDER BY timestamp DESC LIMIT 1',
+     'idx_ai_summaries_customer_ts'),
+    ('SELECT reply, created_at FROM ai_reply_cache WHERE cache_key=? AND created_at >= ?',
+     'sqlite_autoindex_ai_reply_cache_1'),
+    ("UPDATE ai_jobs SET status='running', attempts=attempts + 1, updated_at=? WHERE id = ("
+     "SELECT id FROM ai_jobs WHERE status='queued' AND run_after <= ? ORDER BY id LIMIT 1) "
+     'RETURNING id, kind, payload, attempts', 'idx_ai_jobs_status'),
+    ('SELECT 1 FROM messages WHERE customer_id=? AND id > ? LIMIT 1', 'idx_messages_customer_ts'),
+    ('SELECT id, direction, message_text FROM messages WHERE customer_id=? AND +id > ? ORDER BY timestamp, id',
+     'idx_messages_customer_ts'),
+    ('SELECT tag FROM customer_tags WHERE customer_id=?', 'idx_customer_tags_unique'),
+    ('SELECT * FROM reminders WHERE customer_id=?', 'idx_reminders_customer'),
+    ('SELECT * FROM reminders WHERE reminder_date <= ? ORDER BY reminder_date', 'idx_reminders_date'),
+    ("SELECT reminder_date, id FROM reminders WHERE status='Pending' AND reminder_date IS NOT NULL "
+     'ORDER BY reminder_date, id LIMIT ?', 'idx_reminders_status_date'),
+    ('SELECT * FROM reminders WHERE status=? AND reminder_date BETWEEN ? AND ? AND (reminder_date, id) > (?, ?) '
+     'ORDER BY reminder_date, id LIMIT ?', 'idx_reminders_status_date'),
+    ('SELECT * FROM reminders WHERE reminder_date BETWEEN ? AND ? AND (reminder_date, id) > (?, ?) '
+     'ORDER BY reminder_date, id LIMIT ?', 'idx_reminders_date'),
+    ('SELECT r.id, c.name FROM reminders r JOIN customers c ON c.id = r.customer_id '
+     'WHERE r.reminder_date BETWEEN ? AND ? AND r.status=? ORDER BY r.reminder_date, r.id LIMIT ?',
+     'idx_reminders_status_date'),
+    ('SELECT r.id, c.name FROM reminders r JOIN customers c ON c.id = r.customer_id '
+     'WHERE r.reminder_date BETWEEN ? AND ? ORDER BY r.reminder_date, r.id LIMIT ?', 'idx_reminders_date'),
+]
+
+
+def check_query_plans(conn):
+    """Return a list of (query, plan) pairs that do not use their expected index,
+    scan a table, or sort in a temporary B-tree."""
+    failures = []
+    for query, index in HOT_QUERIES:
+        params = (None,) * query.count('?')
+        plan = ' | '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params))
+        uses_index = f'INDEX {index} ' in plan + ' '
+        if not uses_index or 'SCAN ' in plan or 'USE TEMP B-TREE' in plan:
+            failures.append((query, plan))
+    return failures
+
+
+def init_db(db_path=DB):
+    # Connect to database (creates if not exists)
+    conn = sqlite3.connect(db_path)
+    had_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='customer_stats'"
+    ).fetchone()
+    create_tables(conn)
+    conn.commit()
+    version = migrate(conn)
+    if not had_stats:
+        rebuild_customer_stats(conn)
+    conn.close()
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Initialize and maintain the CRM database.')
+    parser.add_argument('command', nargs='?', default='init', choices=['init', 'rebuild-stats', 'rebuild-rollups', 'check-plans', 'compact'])
+    parser.add_argument('--db', default=DB)
+    parser.add_argument('--archive', help='archive database to include in rebuilds (default: <db>_archive.db if present)')
+    args = parser.parse_args()
 
-conn.commit()
-conn.close()
-print("ai_replies table created successfully.")
+    if args.command in ('rebuild-stats', 'rebuild-rollups'):
+        import archive
+        archive_path = args.archive or archive.default_path(args.db)
 
-print("Database initialized successfully with Business Intelligence & AI features!")
+    if args.command == 'rebuild-stats':
+        conn = sqlite3.connect(args.db)
+        archive.attach(conn, archive_path)
+        rebuild_customer_stats(conn)
+        conn.close()
+        print("Customer stats rebuilt.")
+    elif args.command == 'rebuild-rollups':
+        conn = sqlite3.connect(args.db)
+        archive.attach(conn, archive_path)
+        rebuild_rollups(conn)
+        conn.commit()
+        conn.close()
+        print("Analytics rollups rebuilt.")
+    elif args.command == 'check-plans':
+        conn = sqlite3.connect(args.db)
+        failures = check_query_plans(conn)
+        conn.close()
+        for query, plan in failures:
+            print(f"NOT INDEXED: {query}\n    {plan}")
+        print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use their index.")
+        sys.exit(1 if failures else 0)
+    elif args.command == 'compact':
+        conn = sqlite3.connect(args.db)
+        orphans, freed = compact(conn)
+        conn.close()
+        for table, count in orphans.items():
+            if count:
+                print(f"Deleted {count} orphaned rows from {table}.")
+        print(f"Reclaimed {freed / 1024 / 1024:.1f} MB.")
+    else:
+        version = init_db(args.db)
+        print(f"Schema version: {version}")
+        print("Database initialized successfully with Business Intelligence & AI features!")
@@ -0,0 +1,218 @@
+import json
+import random
+import threading
+import time
+
+import db
+
+# ------------------- RATE LIMITING -------------------
+class RateLimiter:
+    """Token bucket allowing `per_minute` calls per minute, shared by all workers."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.per_minute <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * 60 / self.per_minute
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """Wraps an OpenAI client so every chat completion goes through a RateLimiter."""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self._limiter = limiter
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self._limiter.acquire()
+        return self._client.chat.completions.create(**kwargs)
+
+
+# ------------------- JOB QUEUE -------------------
+class JobQueue:
+    """Persistent queue of AI jobs in the ai_jobs table, run by worker threads.
+
+    Jobs are claimed with an atomic UPDATE ... RETURNING, so several
+    processes can share one database. Handlers are registered per job kind
+    and called as handler(conn, payload) -> result dict. Exceptions listed
+    in `retry_on` are retried with exponential backoff; anything else fails
+    the job.
+    """
+
+    POLL_INTERVAL = 1.0
+    STALE_AFTER = 600       # seconds before a 'running' job is considered abandoned
+    KEEP_FINISHED = 86400   # seconds finished jobs are kept for polling
+
+    def __init__(self, path=db.DB, workers=4, max_attempts=5, backoff=2.0, retry_on=()):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retry_on = tuple(retry_on)
+        self.handlers = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._finished = threading.Condition()
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    # Lifecycle
+    def start(self):
+        """Start the workers once per process; safe to call repeatedly."""
+        with self._lock:
+            if self._threads:
+                return
+            conn = db.pooled_connection(self.path)
+            now = time.time()
+            conn.execute(
+                "UPDATE ai_jobs SET status='queued', updated_at=? WHERE status='running' AND updated_at < ?",
+                (now, now - self.STALE_AFTER)
+            )
+            conn.execute(
+                "DELETE FROM ai_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - self.KEEP_FINISHED,)
+            )
+            conn.commit()
+            self._stop.clear()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'ai-job-worker-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    # Producer side
+    def enqueue(self, conn, kind, payload, dedupe=True):
+        """Queue a job and return its id. With dedupe, an identical job that
+        is still queued or running is reused instead."""
+        payload_json = json.dumps(payload, sort_keys=True)
+        if dedupe:
+            existing = conn.execute(
+                "SELECT id FROM ai_jobs WHERE kind=? AND payload=? AND status IN ('queued', 'running')",
+                (kind, payload_json)
+            ).fetchone()
+            if existing:
+                return existing[0]
+        now = time.time()
+        job_id = conn.execute(
+            'INSERT INTO ai_jobs (kind, payload, created_at, updated_at) VALUES (?, ?, ?, ?)',
+            (kind, payload_json, now, now)
+        ).lastrowid
+        conn.commit()
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, conn, job_id):
+        row = conn.execute('SELECT * FROM ai_jobs WHERE id=?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {'id': row['id'], 'kind': row['kind'], 'status': row['status'],
+               'attempts': row['attempts'], 'error': row['error']}
+        job['result'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def wait(self, conn, job_id, timeout):
+        """Long-poll: return the job once finished or after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(conn, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in ('done', 'failed') or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, self.POLL_INTERVAL))
+
+    # Worker side
+    def _claim(self, conn):
+        now = time.time()
+        row = conn.execute('''
+            UPDATE ai_jobs SET status='running', attempts=attempts + 1, updated_at=?
+            WHERE id = (
+                SELECT id FROM ai_jobs WHERE status='queued' AND run_after <= ? ORDER BY id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+        ''', (now, now)).fetchone()
+        conn.commit()
+        return row
+
+    def _finish(self, conn, job_id, status, result=None, error=None, run_after=0):
+        conn.execute(
+            'UPDATE ai_jobs SET status=?, result=?, error=?, run_after=?, updated_at=? WHERE id=?',
+            (status, json.dumps(result) if result is not None else None, error, run_after, time.time(), job_id)
+        )
+        conn.commit()
+        with self._finished:
+            self._finished.notify_all()
+
+    def run_one(self, conn):
+        """Claim and run a single job. Returns False if none was ready."""
+        job = self._claim(conn)
+        if job is None:
+            return False
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job['kind']!r}")
+            result = handler(conn, json.loads(job['payload']))
+        except self.retry_on as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if job['attempts'] < self.max_attempts:
+                delay = self.backoff * 2 ** (job['attempts'] - 1) * (1 + random.random() / 2)
+                self._finish(conn, job['id'], 'queued', error=str(e), run_after=time.time() + delay)
+            else:
+                self._finish(conn, job['id'], 'failed', error=f'{type(e).__name__}: {e}')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self._finish(conn, job['id'], 'failed', error=f'{type(e).__name__}: {e}')
+        else:
+            self._finish(conn, job['id'], 'done', result=result)
+        return True
+
+    def _work(self):
+        conn = db.pooled_connection(self.path)
+        try:
+            while not self._stop.is_set():
+                if not self.run_one(conn):
+                    with self._wakeup:
+                        self._wakeup.wait(self.POLL_INTERVAL)
+        finally:
+            db.close_thread_connections()
+
+    def drain(self, conn, timeout=None):
+        """Block until no queued or running jobs remain (for batch commands)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while conn.execute("SELECT 1 FROM ai_jobs WHERE status IN ('queued', 'running') LIMIT 1").fetchone():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            with self._finished:
+                self._finished.wait(self.POLL_INTERVAL)
+        return True
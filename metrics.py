@@ -0,0 +1,214 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+
+import db
+
+# ------------------- REGISTRY -------------------
+# Minimal Prometheus text-format metrics. Everything is kept in process
+# memory behind one lock; /metrics renders it on demand.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+log = logging.getLogger('crm.sql')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [count per bucket..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        names = self.label_names + ('le',)
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}'
+
+
+def register_collector(collect):
+    """Add a function called at scrape time that yields (name, type, help, [(labels dict, value)])."""
+    _collectors.append(collect)
+
+
+def render():
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# ------------------- METRICS -------------------
+REQUESTS = Counter('crm_http_requests_total', 'HTTP requests by route, method and status.',
+                   ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('crm_http_request_duration_seconds', 'Time to build the response, by route.',
+                            ('route', 'method'))
+REQUEST_SQL_QUERIES = Histogram('crm_http_request_sql_queries', 'SQL statements run per request, by route.',
+                                ('route',), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('crm_http_request_sql_seconds', 'Time spent in SQL per request, by route.',
+                                ('route',))
+SQL_QUERIES = Counter('crm_sql_queries_total', 'SQL statements run, including background workers.')
+SQL_SECONDS = Counter('crm_sql_seconds_total', 'Time spent executing SQL statements.')
+SLOW_QUERIES = Counter('crm_sql_slow_queries_total', 'SQL statements slower than the slow-query threshold.')
+AI_CALL_SECONDS = Histogram('crm_ai_call_duration_seconds', 'OpenAI chat completion latency.', ('model',),
+                            (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32))
+AI_CALLS = Counter('crm_ai_calls_total', 'OpenAI chat completion calls by outcome.', ('model', 'outcome'))
+AI_TOKENS = Counter('crm_ai_tokens_total', 'OpenAI tokens used.', ('model', 'kind'))
+AI_REQUESTS = Counter('crm_ai_requests_total', 'AI reply and summary requests by how they were served.',
+                      ('endpoint', 'result'))
+
+
+# ------------------- SQL TIMING -------------------
+_request = threading.local()
+slow_query_seconds = 0.1
+
+
+def _record_sql(sql, elapsed):
+    SQL_QUERIES.inc()
+    SQL_SECONDS.inc(amount=elapsed)
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.seconds += elapsed
+    if elapsed >= slow_query_seconds:
+        SLOW_QUERIES.inc()
+        log.warning('slow query (%.1f ms): %s', elapsed * 1000, ' '.join(sql.split()))
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that times execute() and executemany().
+
+    Times cover running each statement up to its first row; rows fetched
+    afterwards are not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+
+# ------------------- AI CLIENT -------------------
+class InstrumentedClient:
+    """Wraps an OpenAI client to record call latency, outcomes and token usage."""
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        model = kwargs.get('model', '')
+        start = time.perf_counter()
+        try:
+            response = self._client.chat.completions.create(**kwargs)
+        except Exception as e:
+            AI_CALLS.inc(model, type(e).__name__)
+            raise
+        finally:
+            AI_CALL_SECONDS.observe(time.perf_counter() - start, model)
+        AI_CALLS.inc(model, 'ok')
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            AI_TOKENS.inc(model, 'prompt', amount=usage.prompt_tokens)
+            AI_TOKENS.inc(model, 'completion', amount=usage.completion_tokens)
+        return response
+
+
+# ------------------- FLASK INTEGRATION -------------------
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    _request.active = True
+    _request.queries = 0
+    _request.seconds = 0.0
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method)
+        REQUESTS.inc(route, request.method, str(response.status_code))
+        REQUEST_SQL_QUERIES.observe(_request.queries, route)
+        REQUEST_SQL_SECONDS.observe(_request.seconds, route)
+    _request.active = False
+    return response
+
+
+def init_app(app, slow_query_ms=100):
+    """Record request and SQL metrics for `app`.
+
+    Only call this when metrics are enabled: it swaps db.py's connection
+    class for TimedConnection. Without it nothing is timed or counted.
+    A slow_query_ms of 0 turns the slow-query log off.
+    """
+    global slow_query_seconds
+    slow_query_seconds = slow_query_ms / 1000 if slow_query_ms > 0 else float('inf')
+    db.connection_factory = TimedConnection
+    app.before_request(_before_request)
+    app.after_request(_after_request)
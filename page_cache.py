@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# page_versions row holding the version of pages that show every customer
+DASHBOARD = 0
+
+
+def page_version(conn, customer_id=DASHBOARD):
+    """Return (version, last modified datetime) of one customer's pages, or of the dashboard.
+
+    Versions are bumped by triggers on every table the pages read (see
+    migration 11 in init_db.py), so writes from any path or process count.
+    """
+    row = conn.execute('SELECT version, updated_at FROM page_versions WHERE customer_id=?',
+                       (customer_id,)).fetchone()
+    if row is None:
+        return 0, None
+    updated_at = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return row[0], updated_at
+
+
+def bump(conn, customer_ids_sql, params=()):
+    """Mark the dashboard and the pages of the customers selected by
+    `customer_ids_sql` (one customer_id column) as changed.
+
+    For writes no trigger sees, such as deletes from the archive database.
+    Customers that no longer exist are skipped.
+    """
+    conn.execute(f'''
+        INSERT INTO page_versions
+        SELECT customer_id, 1, CURRENT_TIMESTAMP FROM ({customer_ids_sql} UNION SELECT {DASHBOARD})
+        WHERE customer_id = {DASHBOARD} OR customer_id IN (SELECT id FROM main.customers)
+        ON CONFLICT DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+    ''', params)
+
+
+# ------------------- PAGE CACHE -------------------
+class PageCache:
+    """In-process LRU of rendered pages, keyed by URL.
+
+    Each entry remembers the ETag it was rendered for; a lookup with a newer
+    ETag is a miss and the entry is replaced on the next put. Holds at most
+    `max_items` pages and `max_bytes` of page text.
+    """
+
+    def __init__(self, max_items=500, max_bytes=32 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[0] != etag:
+                self.counters['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, etag, body):
+        if self.max_items <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._items[key] = (etag, body)
+            self._bytes += len(body)
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, size=len(self._items), bytes=self._bytes)
+        requests = stats['hits'] + stats['misses'] + stats['not_modified']
+        stats['hit_rate'] = (stats['hits'] + stats['not_modified']) / requests if requests else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
@@ -0,0 +1,163 @@
+import argparse
+import heapq
+import threading
+import time
+from datetime import datetime
+
+import db
+
+# Reminder dates are stored as local time in this format so they compare
+# correctly as strings (see migration 9 in init_db.py).
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def normalize_due(value):
+    """'2026-10-18T14:30' or '2026-10-18' -> '2026-10-18 14:30:00'; ValueError if invalid."""
+    return datetime.fromisoformat(value.strip()).strftime(DATE_FORMAT)
+
+
+def now_string():
+    return datetime.now().strftime(DATE_FORMAT)
+
+
+# ------------------- REMINDER SCHEDULER -------------------
+class ReminderScheduler:
+    """Fires pending reminders when they come due.
+
+    Only the nearest `window` pending reminders are held in a heap, loaded
+    with one range scan of the (status, reminder_date) index, so the table
+    is never polled as a whole. Due reminders are fired in batches: marked
+    Done and logged to activity_timeline in one transaction. The
+    status='Pending' guard on that UPDATE makes firing safe when several
+    processes run a scheduler against the same database.
+    """
+
+    MAX_SLEEP = 60      # seconds; upper bound on waiting for the next reminder
+    RESYNC_EVERY = 300  # seconds; reload the window to pick up other writers' reminders
+
+    def __init__(self, path=db.DB, window=1000, batch_size=500):
+        self.path = path
+        self.window = window
+        self.batch_size = batch_size
+        self.fired = 0
+        self._heap = []
+        self._horizon = None   # last (reminder_date, id) loaded; None when all pending fit in the heap
+        self._loaded_at = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+
+    # Lifecycle
+    def start(self):
+        """Start the scheduler thread once per process; safe to call repeatedly."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._loaded_at = 0.0
+            self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stop.set()
+            self._wakeup.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def schedule(self, reminder_id, reminder_date):
+        """Tell the scheduler about a new pending reminder (after it is committed)."""
+        with self._lock:
+            if self._horizon is None or (reminder_date, reminder_id) < self._horizon:
+                heapq.heappush(self._heap, (reminder_date, reminder_id))
+                self._wakeup.notify_all()
+
+    # Scheduling
+    def load(self, conn):
+        """Refill the heap with the nearest pending reminders."""
+        rows = conn.execute(
+            "SELECT reminder_date, id FROM reminders WHERE status='Pending' AND reminder_date IS NOT NULL "
+            'ORDER BY reminder_date, id LIMIT ?',
+            (self.window,)
+        ).fetchall()
+        with self._lock:
+            self._heap = [tuple(r) for r in rows]
+            heapq.heapify(self._heap)
+            self._horizon = tuple(rows[-1]) if len(rows) == self.window else None
+            self._loaded_at = time.monotonic()
+
+    def _due(self, now):
+        with self._lock:
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap)[1])
+            return due
+
+    def fire(self, conn, reminder_ids, now):
+        """Mark due reminders Done and log them; returns the rows actually fired."""
+        placeholders = ','.join('?' * len(reminder_ids))
+        rows = conn.execute(
+            f"UPDATE reminders SET status='Done' WHERE id IN ({placeholders}) "
+            "AND status='Pending' AND reminder_date <= ? RETURNING id, customer_id, reminder_text",
+            [*reminder_ids, now]
+        ).fetchall()
+        conn.executemany(
+            'INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
+            [(r['customer_id'], f"Reminder due: {r['reminder_text']}") for r in rows]
+        )
+        conn.commit()
+        self.fired += len(rows)
+        return rows
+
+    def run_pending(self, conn):
+        """Fire everything due now, batch by batch. Returns the number fired."""
+        fired = 0
+        now = now_string()
+        while True:
+            if not self._heap and self._horizon is not None:
+                self.load(conn)
+            due = self._due(now)
+            if not due:
+                return fired
+            fired += len(self.fire(conn, due, now))
+
+    def _seconds_until_next(self):
+        if not self._heap:
+            return self.MAX_SLEEP
+        try:
+            due = datetime.strptime(self._heap[0][0], DATE_FORMAT)
+        except ValueError:
+            heapq.heappop(self._heap)  # unparseable legacy date; it can never come due
+            return 0
+        return min(max((due - datetime.now()).total_seconds(), 0), self.MAX_SLEEP)
+
+    def _run(self):
+        conn = db.pooled_connection(self.path)
+        try:
+            while not self._stop.is_set():
+                if time.monotonic() - self._loaded_at > self.RESYNC_EVERY:
+                    self.load(conn)
+                self.run_pending(conn)
+                with self._lock:
+                    if not self._stop.is_set():
+                        self._wakeup.wait(self._seconds_until_next())
+        finally:
+            db.close_thread_connections()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the reminder scheduler as its own process.')
+    parser.add_argument('--db', default=db.DB)
+    args = parser.parse_args()
+
+    scheduler = ReminderScheduler(args.db)
+    scheduler.start()
+    print("Reminder scheduler running; Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        scheduler.stop()
+        print(f"Fired {scheduler.fired} reminders.")
@@ -0,0 +1,170 @@
+import argparse
+import re
+import sqlite3
+
+DB = 'crm.db'
+RETAG_BATCH_SIZE = 10000
+
+
+# ------------------- RULE MATCHER -------------------
+def normalize_keyword(keyword):
+    return ' '.join(keyword.lower().split())
+
+
+class TagMatcher:
+    """Every tagging rule compiled into a single word-boundary regex.
+
+    One pass over the message finds all keywords, instead of one substring
+    scan per keyword list. The lookahead lets overlapping keywords (e.g.
+    "in stock" and "stock") both match.
+    """
+
+    def __init__(self, rules):
+        self.tags_by_keyword = {}
+        for tag, keyword in rules:
+            key = normalize_keyword(keyword)
+            if key:
+                self.tags_by_keyword.setdefault(key, []).append(tag)
+        keywords = sorted(self.tags_by_keyword, key=len, reverse=True)
+        self.regex = None
+        if keywords:
+            alternation = '|'.join(re.escape(k).replace(r'\ ', r'\s+') for k in keywords)
+            self.regex = re.compile(rf'(?=\b({alternation})\b)', re.IGNORECASE)
+
+    def tags(self, text):
+        """Tags for `text`, in first-match order, without duplicates."""
+        if self.regex is None or not text:
+            return []
+        found = {}
+        for match in self.regex.finditer(text):
+            keyword = match.group(1).lower()
+            tags = self.tags_by_keyword.get(keyword) or self.tags_by_keyword[normalize_keyword(keyword)]
+            for tag in tags:
+                found.setdefault(tag, None)
+        return list(found)
+
+
+_matchers = {}
+
+
+def rules_signature(conn):
+    return tuple(conn.execute(
+        'SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(LENGTH(tag) + LENGTH(keyword)), 0) FROM tag_rules'
+    ).fetchone())
+
+
+def get_matcher(conn):
+    """Compiled matcher for the rules in `conn`, rebuilt only when they change."""
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    signature = rules_signature(conn)
+    cached = _matchers.get(path)
+    if cached is None or cached[0] != signature:
+        rules = conn.execute('SELECT tag, keyword FROM tag_rules ORDER BY id').fetchall()
+        cached = _matchers[path] = (signature, TagMatcher((r[0], r[1]) for r in rules))
+    return cached[1]
+
+
+# ------------------- TAGGING -------------------
+def apply_tags(conn, customer_id, message_text):
+    """Tag a customer from one message inside the caller's transaction.
+
+    Returns the tags that were new for this customer; only those get an
+    activity_timeline entry.
+    """
+    added = []
+    for tag in get_matcher(conn).tags(message_text):
+        inserted = conn.execute(
+            'INSERT OR IGNORE INTO customer_tags (customer_id, tag) VALUES (?, ?)', (customer_id, tag)
+        ).rowcount
+        if inserted:
+            added.append(tag)
+    conn.executemany(
+        'INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
+        [(customer_id, f'Auto-tagged: {tag}') for tag in added]
+    )
+    return added
+
+
+def tag_batch(conn, messages, matcher=None):
+    """Tag customers from many (customer_id, message_text) pairs at once.
+
+    Existing tags for the customers involved are loaded in one query per
+    500 customers; only new pairs are inserted and logged. Returns the
+    number of tags added.
+    """
+    matcher = matcher or get_matcher(conn)
+    candidates = {}
+    for customer_id, text in messages:
+        for tag in matcher.tags(text):
+            candidates[(customer_id, tag)] = None
+    if not candidates:
+        return 0
+    customer_ids = list({customer_id for customer_id, _ in candidates})
+    existing = set()
+    for i in range(0, len(customer_ids), 500):
+        chunk = customer_ids[i:i + 500]
+        existing.update(tuple(r) for r in conn.execute(
+            f'SELECT customer_id, tag FROM customer_tags WHERE customer_id IN ({",".join("?" * len(chunk))})', chunk
+        ))
+    new_pairs = [pair for pair in candidates if pair not in existing]
+    conn.executemany('INSERT OR IGNORE INTO customer_tags (customer_id, tag) VALUES (?, ?)', new_pairs)
+    conn.executemany(
+        'INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
+        [(customer_id, f'Auto-tagged: {tag}') for customer_id, tag in new_pairs]
+    )
+    return len(new_pairs)
+
+
+def retag_messages(conn, reset=False, batch_size=RETAG_BATCH_SIZE):
+    """Run every stored message through the current rules.
+
+    Messages are read in id-ordered keyset batches and new (customer, tag)
+    pairs are written with executemany, one transaction per batch. With
+    reset=True existing tags are cleared first, so removed rules stop
+    applying. Returns (messages scanned, tags added).
+    """
+    matcher = get_matcher(conn)
+    if reset:
+        conn.execute('DELETE FROM customer_tags')
+        conn.commit()
+    seen = {tuple(r) for r in conn.execute('SELECT customer_id, tag FROM customer_tags')}
+    scanned = added = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, customer_id, message_text FROM messages WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        new_pairs = []
+        for _, customer_id, text in rows:
+            for tag in matcher.tags(text):
+                pair = (customer_id, tag)
+                if pair not in seen:
+                    seen.add(pair)
+                    new_pairs.append(pair)
+        conn.executemany('INSERT OR IGNORE INTO customer_tags (customer_id, tag) VALUES (?, ?)', new_pairs)
+        conn.executemany(
+            'INSERT INTO activity_timeline (customer_id, action) VALUES (?, ?)',
+            [(customer_id, f'Auto-tagged: {tag}') for customer_id, tag in new_pairs]
+        )
+        conn.commit()
+        scanned += len(rows)
+        added += len(new_pairs)
+        last_id = rows[-1][0]
+    return scanned, added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-tag customers from their message history.')
+    parser.add_argument('command', choices=['retag'])
+    parser.add_argument('--db', default=DB)
+    parser.add_argument('--reset', action='store_true', help='clear existing tags before re-tagging')
+    parser.add_argument('--batch-size', type=int, default=RETAG_BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    scanned, added = retag_messages(conn, reset=args.reset, batch_size=args.batch_size)
+    conn.close()
+    print(f"Scanned {scanned} messages, added {added} tags.")
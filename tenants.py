@@ -0,0 +1,152 @@
+"""Multi-tenant storage: one SQLite database per business.
+
+With TENANTS_DIR set, every request is routed by its X-Tenant header (or
+the first label of its host name under TENANT_DOMAIN) to
+<TENANTS_DIR>/<tenant>/crm.db, so each shop has its own write lock, WAL
+and archive file. Tenant databases are created and migrated with the same
+code as the single-tenant one (init_db.py).
+
+    python tenants.py create shop1 --dir tenants
+    python tenants.py migrate --dir tenants
+    python tenants.py list --dir tenants
+"""
+import argparse
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, jsonify, request
+
+import db
+from init_db import MIGRATIONS, init_db, schema_version
+
+TENANT_NAME = re.compile(r'[a-z0-9][a-z0-9_-]{0,62}')
+DB_FILE = 'crm.db'
+
+
+class TenantRouter:
+    """Maps tenant names to database files under `directory`."""
+
+    def __init__(self, directory, header='X-Tenant', domain=None):
+        self.directory = directory
+        self.header = header
+        self.domain = domain.lower().lstrip('.') if domain else None
+
+    def path(self, tenant):
+        """Database file of `tenant`; ValueError for names that are not valid tenant names."""
+        if not TENANT_NAME.fullmatch(tenant or ''):
+            raise ValueError(f"Invalid tenant name: {tenant!r}")
+        return os.path.join(self.directory, tenant, DB_FILE)
+
+    def exists(self, tenant):
+        return os.path.exists(self.path(tenant))
+
+    def tenants(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if TENANT_NAME.fullmatch(name) and os.path.exists(os.path.join(self.directory, name, DB_FILE)))
+
+    def resolve(self, req):
+        """Tenant name for a request, from the header or the host name; None if absent."""
+        tenant = req.headers.get(self.header)
+        if not tenant and self.domain:
+            host = req.host.split(':')[0].lower()
+            if host.endswith('.' + self.domain):
+                tenant = host[:-len(self.domain) - 1].split('.')[-1]
+        return tenant.strip().lower() if tenant else None
+
+    # Administration
+    def create(self, tenant):
+        """Create (or migrate) a tenant's database. Returns its schema version."""
+        path = self.path(tenant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return init_db(path)
+
+    def migrate(self):
+        """Bring every tenant database up to date. Returns {tenant: version}."""
+        return {tenant: init_db(self.path(tenant)) for tenant in self.tenants()}
+
+    def outdated(self):
+        """Tenants whose databases still need migrating."""
+        behind = []
+        for tenant in self.tenants():
+            conn = db.open_connection(self.path(tenant), readonly=True)
+            try:
+                if schema_version(conn) < len(MIGRATIONS):
+                    behind.append(tenant)
+            finally:
+                conn.close()
+        return behind
+
+
+def fan_out(router, fn, tenants=None, workers=8):
+    """Run fn(conn) on each tenant database in parallel.
+
+    Each call gets its own read-only connection; returns {tenant: result},
+    with {'error': ...} for tenants whose call failed.
+    """
+    def run(tenant):
+        conn = db.open_connection(router.path(tenant), readonly=True)
+        try:
+            return fn(conn)
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+        finally:
+            conn.close()
+
+    tenants = router.tenants() if tenants is None else tenants
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenants)))) as pool:
+        return dict(zip(tenants, pool.map(run, tenants)))
+
+
+# ------------------- FLASK INTEGRATION -------------------
+def init_app(app, router, exempt=()):
+    """Route every request (except the `exempt` endpoints) to its tenant's database."""
+    app.extensions['tenants'] = router
+
+    @app.before_request
+    def route_tenant():
+        if request.endpoint in exempt:
+            return None
+        tenant = router.resolve(request)
+        if not tenant:
+            return jsonify({"error": f"No tenant given; send the {router.header} header."}), 400
+        try:
+            path = router.path(tenant)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not os.path.exists(path):
+            return jsonify({"error": f"Unknown tenant: {tenant}"}), 404
+        g.tenant = tenant
+        g.db_path = path
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['create', 'migrate', 'list'])
+    parser.add_argument('tenant', nargs='?')
+    parser.add_argument('--dir', default=os.getenv('TENANTS_DIR', 'tenants'))
+    args = parser.parse_args()
+
+    router = TenantRouter(args.dir)
+    if args.command == 'create':
+        if not args.tenant:
+            sys.exit("create needs a tenant name.")
+        try:
+            version = router.create(args.tenant)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"{args.tenant}: schema version {version} at {router.path(args.tenant)}")
+    elif args.command == 'migrate':
+        for tenant, version in router.migrate().items():
+            print(f"{tenant}: schema version {version}")
+    else:
+        for tenant in router.tenants():
+            print(tenant)
+
+
+if __name__ == '__main__':
+    main()
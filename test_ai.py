@@ -0,0 +1,56 @@
+import ai
+import db
+
+
+class RecordingClient(ai.FakeClient):
+    def __init__(self):
+        super().__init__(latency=0)
+        self.prompts = []
+
+    def create(self, model, messages, max_tokens=None, **kwargs):
+        self.prompts.append(messages[-1]['content'])
+        return super().create(model, messages, max_tokens, **kwargs)
+
+
+def add_messages(conn, customer_id, texts):
+    conn.executemany('INSERT INTO messages (customer_id, message_text, direction) VALUES (?, ?, ?)',
+                     [(customer_id, text, 'in') for text in texts])
+    conn.commit()
+
+
+def customer(crm):
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    conn.execute("INSERT INTO customers (name, instagram_handle) VALUES ('Test', 'test')")
+    customer_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return conn, customer_id
+
+
+def test_update_summary_only_sends_new_messages(crm):
+    conn, customer_id = customer(crm)
+    add_messages(conn, customer_id, ['first question', 'second question'])
+    client = RecordingClient()
+
+    summary, updated = ai.update_summary(conn, client, 'm', customer_id)
+    assert updated and client.calls == 1
+    assert ai.update_summary(conn, client, 'm', customer_id) == (summary, False)
+    assert client.calls == 1
+
+    add_messages(conn, customer_id, ['a new question'])
+    ai.update_summary(conn, client, 'm', customer_id)
+    assert client.calls == 3  # the delta, then merging it into the stored summary
+    delta = client.prompts[1]
+    assert 'a new question' in delta and 'first question' not in delta
+    assert ai.current_summary(conn, customer_id) is not None
+
+
+def test_long_history_is_chunked_under_the_token_budget(crm):
+    conn, customer_id = customer(crm)
+    add_messages(conn, customer_id, [f'message {i} ' + 'x' * 400 for i in range(100)] + ['y' * 20000])
+    client = RecordingClient()
+
+    ai.update_summary(conn, client, 'm', customer_id)
+    maps = [p for p in client.prompts if p.startswith(ai.SUMMARIZE_PROMPT)]
+    reduces = [p for p in client.prompts if p.startswith(ai.MERGE_PROMPT)]
+    assert len(maps) > 2 and len(reduces) == 1
+    assert all(ai.estimate_tokens(p) <= ai.SUMMARY_CHUNK_TOKENS for p in client.prompts)
+    assert all(f'message {i} ' in ''.join(maps) for i in range(100))
@@ -0,0 +1,36 @@
+import archive
+import db
+import init_db
+import page_cache
+
+STATS_SQL = 'SELECT customer_id, orders_count, messages_count, category FROM customer_stats ORDER BY customer_id'
+ROLLUPS_SQL = 'SELECT metric, day, dimension, ROUND(value, 4) FROM daily_rollups WHERE value != 0 ORDER BY 1, 2, 3'
+
+
+def snapshot(conn):
+    return [tuple(r) for r in conn.execute(STATS_SQL)], [tuple(r) for r in conn.execute(ROLLUPS_SQL)]
+
+
+def rebuilt(conn):
+    init_db.rebuild_customer_stats(conn)
+    init_db.rebuild_rollups(conn)
+    conn.commit()
+    return snapshot(conn)
+
+
+def test_purge_and_delete_keep_stats_rollups_and_pages_current(crm):
+    crm.seed(40)
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    dashboard = page_cache.page_version(conn)[0]
+
+    report = archive.run(conn, days=30, retention_days=60)
+    assert report['messages']['purged'] > 0
+    assert page_cache.page_version(conn)[0] > dashboard
+    assert snapshot(conn) == rebuilt(conn)
+
+    customer_id = conn.execute('SELECT customer_id FROM archive.messages LIMIT 1').fetchone()[0]
+    dashboard = page_cache.page_version(conn)[0]
+    with crm.app.test_request_context():
+        crm.delete_customers(crm.get_db_connection(), [customer_id])
+    assert page_cache.page_version(conn)[0] > dashboard
+    assert snapshot(conn) == rebuilt(conn)
@@ -0,0 +1,17 @@
+import db
+
+
+def test_merge_keeps_last_activity(crm):
+    crm.seed(5)
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    conn.execute("UPDATE customer_stats SET last_activity = '2020-01-0' || customer_id || ' 00:00:00'")
+    conn.commit()
+    before = conn.execute('SELECT SUM(orders_count), SUM(messages_count) FROM customer_stats '
+                          'WHERE customer_id IN (1, 2, 3)').fetchone()
+
+    client = crm.app.test_client()
+    assert client.post('/customers/merge', json={'into': 1, 'ids': [2, 3]}).status_code == 200
+
+    row = conn.execute('SELECT orders_count, messages_count, last_activity FROM customer_stats '
+                       'WHERE customer_id=1').fetchone()
+    assert tuple(row) == (*before, '2020-01-03 00:00:00')
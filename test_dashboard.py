@@ -0,0 +1,69 @@
+import db
+
+
+def count_statements(fn):
+    """Run fn() and return how many SQL statements this thread executed."""
+    statements = []
+    db.connection_hooks.append(lambda conn: conn.set_trace_callback(statements.append))
+    db.close_thread_connections()  # reopen so the hook is installed
+    try:
+        fn()
+    finally:
+        db.connection_hooks.pop()
+        db.close_thread_connections()
+    return len([s for s in statements if not s.startswith(('PRAGMA', 'ATTACH'))])
+
+
+def dashboard_statements(crm, customers):
+    crm.seed(customers)
+
+    def load():
+        with crm.app.app_context():
+            conn = crm.get_db_connection(readonly=True)
+            rows, _ = crm.dashboard_customers(conn)
+            assert len(rows) == customers
+            crm.dashboard_totals(conn)
+
+    return count_statements(load)
+
+
+def test_dashboard_query_count_is_flat(crm, tmp_path, monkeypatch):
+    small = dashboard_statements(crm, 10)
+    monkeypatch.setitem(crm.app.config, 'DATABASE', str(tmp_path / 'large.db'))
+    large = dashboard_statements(crm, 200)
+    assert small == large
+
+
+def test_index_query_count_is_flat(crm):
+    client = crm.app.test_client()
+    crm.seed(10)
+    small = count_statements(lambda: client.get('/'))
+    crm.seed(190)
+    crm.rendered_pages.clear()
+    large = count_statements(lambda: client.get('/'))
+    assert small == large
+
+
+def test_index_pages_customers(crm):
+    crm.seed(crm.PAGE_SIZE + 5)
+    with crm.app.test_request_context():
+        conn = crm.get_db_connection(readonly=True)
+        first, _, next_after = crm.dashboard_page(conn)
+        rest, _, last = crm.dashboard_page(conn, next_after)
+    assert len(first) == crm.PAGE_SIZE
+    assert [c['id'] for c in rest] == list(range(next_after + 1, next_after + 6))
+    assert last is None
+
+
+def test_search_is_bounded_and_flags_capped_totals(crm, monkeypatch):
+    crm.seed(40)
+    with crm.app.test_request_context():
+        conn = crm.get_db_connection(readonly=True)
+        customers, _, totals, snippets = crm.search_customers(conn, 'price')
+        assert customers and not totals['total_capped']
+        assert all('[' in s['snippet'] for found in snippets.values() for s in found)
+        assert set(snippets) <= {c['id'] for c in customers}
+
+        monkeypatch.setattr(crm, 'SEARCH_MAX_HITS', 5)
+        customers, _, totals, _ = crm.search_customers(conn, 'price')
+    assert totals['total_capped'] and 0 < totals['total_customers'] <= 10
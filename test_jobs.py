@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+import ai
+import db
+import jobs
+
+
+def test_ai_reply_returns_before_the_slow_call(crm):
+    crm.seed(3)
+    client = crm.app.test_client()
+    latency = float(os.environ['AI_FAKE_LATENCY'])
+    form = {'customer_id': '1', 'message': 'is the blue one in stock?', 'tone': 'friendly'}
+
+    start = time.perf_counter()
+    response = client.post('/ai_reply', data=form)
+    assert response.status_code == 202
+    assert time.perf_counter() - start < latency
+
+    job = client.get(f"/jobs/{response.get_json()['job_id']}?wait=2").get_json()
+    assert job['status'] == 'done'
+    assert 'is the blue one in stock?' in job['result']['reply']
+
+    cached = client.post('/ai_reply', data=form)
+    assert cached.status_code == 200
+    assert cached.get_json()['cached'] is True
+
+
+def test_summary_job_and_precompute(crm):
+    crm.seed(3)
+    client = crm.app.test_client()
+    response = client.get('/summary/2')
+    assert response.status_code == 202
+    job = client.get(f"/jobs/{response.get_json()['job_id']}?wait=2").get_json()
+    assert job['status'] == 'done' and job['result']['summary']
+    assert client.get('/summary/2').get_json()['summary'] == job['result']['summary']
+
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    queue = crm.services(crm.app.config['DATABASE']).job_queue
+    job_ids = crm.enqueue_activity_summaries(conn, queue, '2000-01-01')
+    assert len(job_ids) == conn.execute('SELECT COUNT(*) FROM customer_stats').fetchone()[0]
+    assert queue.drain(conn, timeout=10)
+    assert all(queue.get(conn, job_id)['status'] == 'done' for job_id in job_ids)
+
+
+def test_rate_limited_jobs_are_retried(crm):
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    queue = jobs.JobQueue(crm.app.config['DATABASE'], backoff=0.01, retry_on=(ai.RateLimitError,))
+    calls = []
+
+    def flaky(conn, payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise ai.RateLimitError('slow down')
+        return {'ok': True}
+
+    queue.register('flaky', flaky)
+    job_id = queue.enqueue(conn, 'flaky', {'n': 1})
+    assert queue.drain(conn, timeout=10)
+    queue.stop()
+    job = queue.get(conn, job_id)
+    assert job['status'] == 'done' and job['attempts'] == 3
+
+
+def test_rate_limiter_spaces_out_calls():
+    fake = ai.FakeClient(latency=0)
+    client = jobs.RateLimitedClient(fake, jobs.RateLimiter(per_minute=600))
+    client._limiter.tokens = 0
+    start = time.perf_counter()
+    for _ in range(3):
+        client.chat.completions.create(model='m', messages=[{'role': 'user', 'content': 'hi'}])
+    assert time.perf_counter() - start >= 0.25  # 600/minute is one call per 0.1s
+    assert fake.calls == 3
+
+
+
+def test_job_status_wait_is_capped(crm, monkeypatch):
+    monkeypatch.setattr(crm, 'JOB_MAX_WAIT', 0.2)
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    queue = crm.services(crm.app.config['DATABASE']).job_queue
+    release = threading.Event()
+    queue.register('slow', lambda conn, payload: release.wait(10) and {})
+    job_id = queue.enqueue(conn, 'slow', {})
+    try:
+        start = time.perf_counter()
+        job = crm.app.test_client().get(f'/jobs/{job_id}?wait=25').get_json()
+        assert time.perf_counter() - start < 2
+        assert job['status'] in ('queued', 'running')
+    finally:
+        release.set()
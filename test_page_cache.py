@@ -0,0 +1,18 @@
+import db
+import page_cache
+
+ORPHANS_SQL = 'SELECT COUNT(*) FROM page_versions WHERE customer_id != 0 AND customer_id NOT IN (SELECT id FROM customers)'
+
+
+def test_deleted_customers_keep_no_page_versions(crm):
+    crm.seed(10)
+    conn = db.pooled_connection(crm.app.config['DATABASE'])
+    client = crm.app.test_client()
+    target_version = page_cache.page_version(conn, 1)[0]
+
+    assert client.post('/customers/merge', json={'into': 1, 'ids': [2, 3]}).status_code == 200
+    assert client.post('/customers/delete', json={'ids': [4, 5]}).status_code == 200
+
+    assert conn.execute(ORPHANS_SQL).fetchone()[0] == 0
+    assert page_cache.page_version(conn, 1)[0] > target_version
+    assert page_cache.page_version(conn, 4) == (0, None)
@@ -0,0 +1,10 @@
+import sqlite3
+
+import init_db
+
+
+def test_hot_queries_use_their_index(tmp_path):
+    path = str(tmp_path / 'crm.db')
+    init_db.init_db(path)
+    conn = sqlite3.connect(path)
+    assert init_db.check_query_plans(conn) == []
@@ -0,0 +1,15 @@
+"""WSGI entry point for multi-process servers, e.g.
+
+    gunicorn --workers 4 --preload wsgi:app
+
+With --preload the app is imported once and workers are forked from it,
+sharing its memory; each worker opens its own database connections and
+starts its own job, scheduler and write-behind threads on first use.
+Run one reminder scheduler for all workers with REMINDER_SCHEDULER=false
+and python scheduler.py.
+Configure with environment variables (or .env): CRM_DB, OPENAI_API_KEY,
+AI_ENABLED, REMINDER_SCHEDULER, METRICS_ENABLED, WRITE_BEHIND, ...
+"""
+from app import create_app
+
+app = create_app()